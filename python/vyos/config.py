@@ -64,10 +64,40 @@ should also use these functions because not having nodes you've just created in
 However, in operational mode, only the running config is available. Currently, you need to use special functions
 for reading it from operational mode scripts, they can be distinguished by the word "effective" in their names.
 In the future base versions may be made to detect if they are called from a config session or not.
+
+Config snapshots
+################
+
+By default every query runs ``cli-shell-api``, which is slow when a script makes
+hundreds of them. A config object created with ``snapshot=True`` loads the proposed
+and the effective configs once and answers all later queries from memory,
+with exactly the same API. If the snapshot cannot be loaded, it falls back to
+running ``cli-shell-api`` for every query.
+
+Node type checks (``is_multi`` etc.) are answered from the command templates,
+which are read directly from the templates directory and remembered for the lifetime
+of the object, since templates do not change. If the templates directory is not
+available, type checks fall back to ``cli-shell-api``.
+
+Query cache
+###########
+
+A config object created with ``cache_size`` set to a positive number remembers
+results of up to that many recent queries. The cache is keyed by operation and absolute
+path, so changing the edit level does not affect it. It is cleared when ``session_changed``
+returns a different result than before, and when a ``vyos.configsession.ConfigSession``
+bound with ``bind_session`` changes the config.
 """
 
+import os
 import subprocess
 import re
+import weakref
+import functools
+import collections
+
+import vyos.configtree
+import vyos.defaults
 
 
 class VyOSError(Exception):
@@ -79,22 +109,81 @@ class VyOSError(Exception):
     pass
 
 
+def _cached(func):
+    """ Memoize results of a query method if the config object has a cache enabled """
+    @functools.wraps(func)
+    def wrapper(self, path, *args, **kwargs):
+        if self._cache is None:
+            return func(self, path, *args, **kwargs)
+
+        key = (func.__name__, " ".join((self._level + path).split()),
+               repr(args), repr(sorted(kwargs.items())))
+        try:
+            res = self._cache[key]
+            self._cache.move_to_end(key)
+            self._cache_hits += 1
+        except KeyError:
+            self._cache_misses += 1
+            res = func(self, path, *args, **kwargs)
+            self._cache[key] = res
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+        # Callers may modify returned lists, don't let them modify the cache
+        if isinstance(res, list):
+            return list(res)
+        return res
+
+    return wrapper
+
+
 class Config(object):
     """
     The class of config access objects.
 
     Internally, in the current implementation, this object is *almost* stateless,
     the only state it keeps is relative *config path* for convenient access to config
-    subtrees.
+    subtrees, and, if created with ``snapshot=True``, in-memory copies of the proposed
+    and effective configs.
     """
-    def __init__(self, session_env=None):
+    _NODE_DEF_FIELD_RE = re.compile(r'^(tag|multi|type):')
+
+    _QUERY_OPS = frozenset([
+        'exists', 'exists_effective',
+        'is_multi', 'is_tag', 'is_leaf',
+        'return_value', 'return_values',
+        'return_effective_value', 'return_effective_values',
+        'list_nodes', 'list_effective_nodes',
+    ])
+
+    # Show the config as it is stored, regardless of edit level and default values
+    _SHOW_CONFIG_OPTIONS = ['--show-show-defaults', '--show-ignore-edit']
+
+    def __init__(self, session_env=None, snapshot=False, cache_size=0):
         self._cli_shell_api = "/bin/cli-shell-api"
+        self._templates_dir = vyos.defaults.directories['templates']
         self._level = ""
         if session_env:
             self.__session_env = session_env
         else:
             self.__session_env = None
 
+        self._snapshot = False
+        self._session_tree = None
+        self._running_tree = None
+        self._node_defs = {}
+
+        self._cache = None
+        self._cache_size = cache_size
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._session_changed = None
+        if cache_size > 0:
+            self._cache = collections.OrderedDict()
+
+        if snapshot:
+            self.load_snapshot()
+
     def _make_command(self, op, path):
         args = path.split()
         cmd = [self._cli_shell_api, op] + args
@@ -110,7 +199,234 @@ class Config(object):
         if p.returncode != 0:
             raise VyOSError()
         else:
-            return out.decode('ascii')
+            # Values such as descriptions can have any characters
+            return out.decode('utf-8')
+
+    def _run_stream(self, cmd, chunk_size=65536):
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, env=self.__session_env,
+                             universal_newlines=True, encoding='utf-8')
+        try:
+            chunk = p.stdout.read(chunk_size)
+            while chunk:
+                yield chunk
+                chunk = p.stdout.read(chunk_size)
+        finally:
+            p.stdout.close()
+            p.wait()
+        if p.returncode != 0:
+            raise VyOSError()
+
+    def _make_tree(self, config_text):
+        # showConfig does not escape backslashes, which configtree expects; cf. T1001
+        if not config_text.strip():
+            return None
+        return vyos.configtree.ConfigTree(config_text.replace("\\", "\\\\"))
+
+    def _tree_path(self, path):
+        return (self._level + path).split()
+
+    def _tree_exists(self, tree, path):
+        if tree is None:
+            return False
+        path = self._tree_path(path)
+        if tree.exists(path):
+            return True
+        # cli-shell-api exists also works for leaf node values, emulate that
+        if len(path) < 2:
+            return False
+        try:
+            return path[-1] in tree.return_values(path[:-1])
+        except vyos.configtree.ConfigTreeError:
+            return False
+
+    def _tree_query(self, tree, op, path, default):
+        if tree is None:
+            return default
+        try:
+            return op(tree, self._tree_path(path))
+        except vyos.configtree.ConfigTreeError:
+            return default
+
+    def _read_node_def(self, template_dir):
+        # Only the fields that define the node type are needed
+        if template_dir not in self._node_defs:
+            try:
+                with open(os.path.join(template_dir, 'node.def'), 'r') as f:
+                    node_def = set(m.group(1) for m in map(self._NODE_DEF_FIELD_RE.match, f) if m)
+            except OSError:
+                node_def = None
+            self._node_defs[template_dir] = node_def
+        return self._node_defs[template_dir]
+
+    def _template_type(self, op, path):
+        # Walk the template tree the way cli-shell-api does: children of tag nodes
+        # share the node.tag template, and leaf nodes can be followed by a value
+        template_dir = self._templates_dir
+        node_def = set()
+        is_value = False
+        for name in self._tree_path(path):
+            if 'tag' in node_def and not is_value:
+                template_dir = os.path.join(template_dir, 'node.tag')
+                is_value = True
+            elif is_value and 'tag' not in node_def:
+                # Leaf node values have no children
+                return False
+            elif 'type' in node_def and 'tag' not in node_def:
+                is_value = True
+            else:
+                if name.startswith('.') or '/' in name or name in ['node.def', 'node.tag']:
+                    return False
+                template_dir = os.path.join(template_dir, name)
+                node_def = self._read_node_def(template_dir)
+                if node_def is None:
+                    return False
+                is_value = False
+
+        if op == 'isTag':
+            return 'tag' in node_def and not is_value
+        elif op == 'isMulti':
+            return 'multi' in node_def
+        else:
+            return not is_value and ('multi' in node_def or
+                                     ('type' in node_def and 'tag' not in node_def))
+
+    def _check_type(self, op, path):
+        if self._snapshot and os.path.isdir(self._templates_dir):
+            return self._template_type(op, path)
+        return self._check_type_uncached(op, path)
+
+    def _check_type_uncached(self, op, path):
+        try:
+            self._run(self._make_command(op, self._level + path))
+            return True
+        except VyOSError:
+            return False
+
+    def load_snapshot(self):
+        """
+        Load the proposed and the effective configs into memory,
+        so that all subsequent queries do not need to run ``cli-shell-api``.
+
+        Returns:
+            True if the snapshot was loaded, False if the object
+            keeps using ``cli-shell-api`` for every query.
+
+        Note:
+            Changes made after the snapshot was loaded are not visible
+            until it is loaded again.
+        """
+        show_config = [self._cli_shell_api] + self._SHOW_CONFIG_OPTIONS
+        try:
+            running_text = self._run(show_config + ['--show-active-only', 'showConfig'])
+            if self.in_session():
+                session_text = self._run(show_config + ['--show-working-only', 'showConfig'])
+            else:
+                session_text = running_text
+            self._running_tree = self._make_tree(running_text)
+            self._session_tree = self._make_tree(session_text)
+        except (VyOSError, OSError, ValueError):
+            # libvyosconfig is not available or the config could not be parsed
+            self.drop_snapshot()
+            return False
+
+        self._snapshot = True
+        # Results remembered before the reload may be out of date
+        self.invalidate_cache()
+        return True
+
+    def drop_snapshot(self):
+        """
+        Discard in-memory configs and go back to running ``cli-shell-api``
+        for every query.
+        """
+        self._snapshot = False
+        self._session_tree = None
+        self._running_tree = None
+        self.invalidate_cache()
+
+    def has_snapshot(self):
+        """
+        Returns:
+            True if queries are answered from an in-memory snapshot, False otherwise.
+        """
+        return self._snapshot
+
+    def get_snapshot(self):
+        """
+        Returns:
+            Config: this object if it already has a snapshot, otherwise
+            a new config object with the same session and edit level that has one.
+        """
+        if self._snapshot:
+            return self
+        config = Config(session_env=self.__session_env, snapshot=True)
+        config._level = self._level
+        return config
+
+    def invalidate_cache(self):
+        """
+        Forget all remembered query results.
+        """
+        if self._cache is not None:
+            self._cache.clear()
+
+    def cache_stats(self):
+        """
+        Returns:
+            dict: query cache ``hits``, ``misses``, and current ``size``
+        """
+        size = len(self._cache) if self._cache is not None else 0
+        return {'hits': self._cache_hits, 'misses': self._cache_misses, 'size': size}
+
+    def bind_session(self, session):
+        """
+        Clear the query cache whenever a config session changes the config.
+
+        Args:
+            session (vyos.configsession.ConfigSession): config session to watch
+        """
+        # The session must not keep this object alive
+        ref = weakref.WeakMethod(self.invalidate_cache)
+
+        def on_change():
+            invalidate = ref()
+            if invalidate is not None:
+                invalidate()
+
+        session.add_change_callback(on_change)
+
+    def query_many(self, queries):
+        """
+        Run multiple queries in one go
+
+        Args:
+            queries (list): list of ``(op, path)`` or ``(op, path, default)`` tuples,
+                where ``op`` is the name of a query method such as ``exists``
+                or ``return_values``, and ``path`` is relative to the edit level
+
+        Returns:
+            list: query results, in the same order as queries
+
+        Raises:
+            VyOSError: if an operation is not a query method, or if
+                one of the queries raises it
+
+        Note:
+            If this object has no snapshot, one is loaded for the queries,
+            which takes one ``showConfig`` call for each of the proposed
+            and the effective configs, instead of one or more ``cli-shell-api``
+            calls per query. Node types are read from the templates,
+            see "Config snapshots" above.
+        """
+        for q in queries:
+            if q[0] not in self._QUERY_OPS:
+                raise VyOSError("\"{0}\" is not a valid query operation".format(q[0]))
+
+        config = self
+        if queries:
+            config = self.get_snapshot()
+
+        return [getattr(config, q[0])(*q[1:]) for q in queries]
 
     def set_level(self, path):
         """
@@ -137,6 +453,7 @@ class Config(object):
         """
         return(self._level.strip())
 
+    @_cached
     def exists(self, path):
         """
         Checks if a node with given path exists in the running or proposed config
@@ -148,6 +465,9 @@ class Config(object):
             This function cannot be used outside a configuration sessions.
             In operational mode scripts, use ``exists_effective``.
         """
+        if self._snapshot:
+            return self._tree_exists(self._session_tree, path)
+
         try:
             self._run(self._make_command('exists', self._level + path))
             return True
@@ -161,9 +481,14 @@ class Config(object):
         """
         try:
             self._run(self._make_command('sessionChanged', ''))
-            return True
+            changed = True
         except VyOSError:
-            return False
+            changed = False
+
+        if changed != self._session_changed:
+            self._session_changed = changed
+            self.invalidate_cache()
+        return changed
 
     def in_session(self):
         """
@@ -176,6 +501,128 @@ class Config(object):
         except VyOSError:
             return False
 
+    def _tree_dict(self, tree, path):
+        path = self._tree_path(path)
+        if (tree is None) or (path and not tree.exists(path)):
+            return None
+        return tree.to_dict(path)
+
+    def subtree_changed(self, path=''):
+        """
+        Checks if a subtree differs between the running and the proposed config
+
+        vyatta-cfg only runs a config script if its own node has changed,
+        this is for scripts that also depend on other parts of the config.
+
+        Args:
+            path (str): Configuration tree path, or empty for the whole config
+
+        Returns:
+            True if the subtree was created, deleted, or modified
+            in the config session, False otherwise
+        """
+        if self._snapshot:
+            running = self._tree_dict(self._running_tree, path)
+            proposed = self._tree_dict(self._session_tree, path)
+            return running != proposed
+
+        texts = []
+        for option in ['--show-active-only', '--show-working-only']:
+            cmd = [self._cli_shell_api] + self._SHOW_CONFIG_OPTIONS + [option, 'showConfig']
+            try:
+                texts.append(self._run(cmd + (self._level + path).split()))
+            except VyOSError:
+                # The path does not exist in this config
+                texts.append(None)
+        return texts[0] != texts[1]
+
+    def get_config_dict(self, path='', effective=False, default=None):
+        """
+        Returns a config subtree as nested dicts, in the format of
+        ``vyos.configtree.ConfigTree.to_dict``, without a round trip
+        through the text format if the object has a snapshot
+
+        Args:
+            path (str): Configuration tree path, or empty for the whole config
+            effective (bool): Use the running config instead of the proposed one
+            default: Value to return if the path does not exist
+
+        Returns:
+            dict: subtree contents
+        """
+        if self._snapshot:
+            tree = self._running_tree if effective else self._session_tree
+            res = self._tree_dict(tree, path)
+            return default if res is None else res
+
+        option = '--show-active-only' if effective else '--show-working-only'
+        cmd = [self._cli_shell_api] + self._SHOW_CONFIG_OPTIONS + [option, 'showConfig']
+        try:
+            tree = self._make_tree(self._run(cmd + (self._level + path).split()))
+        except VyOSError:
+            return default
+        return tree.to_dict() if tree is not None else {}
+
+    def iter_config(self, path='', format='raw', effective=False):
+        """
+        Generates a config subtree piece by piece, so that large configs
+        can be sent somewhere without keeping a complete copy in memory
+
+        Args:
+            path (str): Configuration tree path, or empty for the whole config
+            format (str): ``raw`` for the output of ``show_config``, ``json`` for
+                the format of ``get_config_dict``, or ``commands`` for set commands
+            effective (bool): Use the running config instead of the proposed one;
+                has no effect on the ``raw`` format, which always shows the proposed config
+
+        Yields:
+            str: parts of the config
+
+        Raises:
+            VyOSError: if the format is not known or the path does not exist
+
+        Note:
+            Without a snapshot, only the requested subtree is read from
+            ``cli-shell-api`` and parsed.
+        """
+        if format == 'raw':
+            yield from self._run_stream(self._make_command('showConfig', self._level + path))
+            return
+        if format not in ['json', 'commands']:
+            raise VyOSError("\"{0}\" is not a valid config format".format(format))
+
+        tree_path = self._tree_path(path)
+        if self._snapshot:
+            tree = self._running_tree if effective else self._session_tree
+            if tree is None and tree_path:
+                raise VyOSError("Path [{0}] does not exist".format(" ".join(tree_path)))
+            subtree_path = tree_path
+        else:
+            if tree_path and not (self.exists_effective(path) if effective else self.exists(path)):
+                raise VyOSError("Path [{0}] does not exist".format(" ".join(tree_path)))
+            option = '--show-active-only' if effective else '--show-working-only'
+            # showConfig prints the contents of the node, they are at the top of the tree
+            tree = self._make_tree(self._run([self._cli_shell_api] + self._SHOW_CONFIG_OPTIONS +
+                                             [option, 'showConfig'] + tree_path))
+            subtree_path = []
+
+        if tree is None:
+            yield '{}' if format == 'json' else ''
+            return
+
+        try:
+            if format == 'json':
+                yield from tree.iter_json(subtree_path)
+            elif subtree_path == tree_path:
+                yield from tree.iter_commands(subtree_path)
+            else:
+                # Commands need full paths
+                prefix = "set {0} ".format(" ".join(tree_path))
+                for c in tree.iter_commands():
+                    yield prefix + c[len("set "):]
+        except vyos.configtree.ConfigTreeError as e:
+            raise VyOSError(str(e))
+
     def show_config(self, path='', default=None):
         """
         Args:
@@ -191,6 +638,7 @@ class Config(object):
         except VyOSError:
             return(default)
 
+    @_cached
     def is_multi(self, path):
         """
         Args:
@@ -202,12 +650,9 @@ class Config(object):
         Note:
             It also returns False if node doesn't exist.
         """
-        try:
-            self._run(self._make_command('isMulti', self._level + path))
-            return True
-        except VyOSError:
-            return False
+        return self._check_type('isMulti', path)
 
+    @_cached
     def is_tag(self, path):
         """
          Args:
@@ -219,12 +664,9 @@ class Config(object):
         Note:
             It also returns False if node doesn't exist.
         """
-        try:
-            self._run(self._make_command('isTag', self._level + path))
-            return True
-        except VyOSError:
-            return False
+        return self._check_type('isTag', path)
 
+    @_cached
     def is_leaf(self, path):
         """
          Args:
@@ -236,12 +678,9 @@ class Config(object):
         Note:
             It also returns False if node doesn't exist.
         """
-        try:
-            self._run(self._make_command('isLeaf', self._level + path))
-            return True
-        except VyOSError:
-            return False
+        return self._check_type('isLeaf', path)
 
+    @_cached
     def return_value(self, path, default=None):
         """
         Retrieve a value of single-value leaf node in the running or proposed config
@@ -269,6 +708,8 @@ class Config(object):
             raise VyOSError("Cannot use return_value on multi node: {0}".format(full_path))
         elif not self.is_leaf(path):
             raise VyOSError("Cannot use return_value on non-leaf node: {0}".format(full_path))
+        elif self._snapshot:
+            return self._tree_query(self._session_tree, vyos.configtree.ConfigTree.return_value, path, default)
         else:
             try:
                 out = self._run(self._make_command('returnValue', full_path))
@@ -276,6 +717,7 @@ class Config(object):
             except VyOSError:
                 return(default)
 
+    @_cached
     def return_values(self, path, default=[]):
         """
         Retrieve all values of a multi-value leaf node in the running or proposed config
@@ -299,6 +741,8 @@ class Config(object):
             raise VyOSError("Cannot use return_values on non-multi node: {0}".format(full_path))
         elif not self.is_leaf(path):
             raise VyOSError("Cannot use return_values on non-leaf node: {0}".format(full_path))
+        elif self._snapshot:
+            return self._tree_query(self._session_tree, vyos.configtree.ConfigTree.return_values, path, default)
         else:
             try:
                 out = self._run(self._make_command('returnValues', full_path))
@@ -307,6 +751,7 @@ class Config(object):
             except VyOSError:
                 return(default)
 
+    @_cached
     def list_nodes(self, path, default=[]):
         """
         Retrieve names of all children of a tag node in the running or proposed config
@@ -329,6 +774,8 @@ class Config(object):
         """
         full_path = self._level + path
         if self.is_tag(path):
+            if self._snapshot:
+                return self._tree_query(self._session_tree, vyos.configtree.ConfigTree.list_nodes, path, default)
             try:
                 out = self._run(self._make_command('listNodes', full_path))
                 values = re.findall(r"\'(.*?)\'", out)
@@ -338,6 +785,7 @@ class Config(object):
         else:
             raise VyOSError("Cannot use list_nodes on a non-tag node: {0}".format(full_path))
 
+    @_cached
     def exists_effective(self, path):
         """
         Check if a node exists in the running (effective) config
@@ -352,12 +800,16 @@ class Config(object):
             This function is safe to use in operational mode. In configuration mode,
             it ignores uncommited changes.
         """
+        if self._snapshot:
+            return self._tree_exists(self._running_tree, path)
+
         try:
             self._run(self._make_command('existsEffective', self._level + path))
             return True
         except VyOSError:
             return False
 
+    @_cached
     def return_effective_value(self, path, default=None):
         """
         Retrieve a values of a single-value leaf node in a running (effective) config
@@ -377,6 +829,8 @@ class Config(object):
             raise VyOSError("Cannot use return_effective_value on multi node: {0}".format(full_path))
         elif not self.is_leaf(path):
             raise VyOSError("Cannot use return_effective_value on non-leaf node: {0}".format(full_path))
+        elif self._snapshot:
+            return self._tree_query(self._running_tree, vyos.configtree.ConfigTree.return_value, path, default)
         else:
             try:
                 out = self._run(self._make_command('returnEffectiveValue', full_path))
@@ -384,6 +838,7 @@ class Config(object):
             except VyOSError:
                 return(default)
 
+    @_cached
     def return_effective_values(self, path, default=[]):
         """
         Retrieve all values of a multi-value node in a running (effective) config
@@ -402,6 +857,8 @@ class Config(object):
             raise VyOSError("Cannot use return_effective_values on non-multi node: {0}".format(full_path))
         elif not self.is_leaf(path):
             raise VyOSError("Cannot use return_effective_values on non-leaf node: {0}".format(full_path))
+        elif self._snapshot:
+            return self._tree_query(self._running_tree, vyos.configtree.ConfigTree.return_values, path, default)
         else:
             try:
                 out = self._run(self._make_command('returnEffectiveValues', full_path))
@@ -410,6 +867,7 @@ class Config(object):
             except VyOSError:
                 return(default)
 
+    @_cached
     def list_effective_nodes(self, path, default=[]):
         """
         Retrieve names of all children of a tag node in the running config
@@ -429,6 +887,8 @@ class Config(object):
         """
         full_path = self._level + path
         if self.is_tag(path):
+            if self._snapshot:
+                return self._tree_query(self._running_tree, vyos.configtree.ConfigTree.list_nodes, path, default)
             try:
                 out = self._run(self._make_command('listEffectiveNodes', full_path))
                 values = out.split()
@@ -18,29 +18,153 @@ A library for retrieving value dicts from VyOS configs in a declarative fashion.
 
 """
 
+import collections
 
-def retrieve_config(path_hash, base_path, config):
+
+_Field = collections.namedtuple('_Field', ['name', 'path', 'type', 'plan'])
+
+_QUERY_OPS = {
+    str: 'return_value',
+    list: 'return_values',
+    bool: 'exists',
+    dict: 'list_nodes',
+}
+
+
+def _empty_value(typ):
+    # What the query for a field returns if its path does not exist
+    if typ == str:
+        return None
+    elif typ == bool:
+        return False
+    else:
+        return typ()
+
+
+class RetrievalPlan(object):
     """
-    Retrieves a VyOS config as a dict according to a declarative description
+    A validated declarative config description, created by ``compile_description``.
 
-    The description dict, passed in the first argument, must follow this format:
-    ``field_name : <path, type, [inner_options_dict]>``.
+    Plans do not depend on the config they are used with, so a plan
+    can be compiled once and used many times.
+    """
+    def __init__(self, fields):
+        self._fields = fields
+
+        # Fields that share the first component of their path are only
+        # looked up if a node with that name exists
+        groups = collections.Counter(f.path[0] for f in fields if len(f.path) > 1)
+        self._prefixes = sorted(p for p in groups if groups[p] > 1)
+
+    def _is_skipped(self, field, existing_prefixes):
+        return (len(field.path) > 1) and (field.path[0] in self._prefixes) and \
+               (field.path[0] not in existing_prefixes)
+
+    def retrieve(self, base_path, config):
+        """
+        Retrieves a config dict according to the plan
+
+        Args:
+            base_path (list): A base path to prepend to all option paths
+            config (vyos.config.Config): A VyOS config object
+
+        Returns:
+            dict: config dict
+
+        Note:
+            See ``retrieve_many`` about config objects without a snapshot.
+        """
+        return self.retrieve_many([base_path], config)[0]
+
+    def retrieve_many(self, base_paths, config):
+        """
+        Retrieves config dicts for multiple base paths at once,
+        e.g. for every child of a tag node
+
+        Args:
+            base_paths (list): A list of base paths
+            config (vyos.config.Config): A VyOS config object
+
+        Returns:
+            list: config dicts, in the same order as base paths
+
+        Note:
+            All queries are answered from a config snapshot. If ``config``
+            has none, a new snapshot of the whole config is loaded on every call,
+            which takes as long as running ``showConfig``. Scripts that retrieve
+            config dicts more than once should pass a config object created
+            with ``snapshot=True``, so that it's loaded only once.
+        """
+        if not base_paths or not self._fields:
+            return [{} for p in base_paths]
+
+        return self._retrieve_many(base_paths, config.get_snapshot())
+
+    def _retrieve_many(self, base_paths, config):
+        if not base_paths or not self._fields:
+            return [{} for p in base_paths]
+
+        existing = [set() for b in base_paths]
+        if self._prefixes:
+            queries = []
+            for base_path in base_paths:
+                for p in self._prefixes:
+                    queries.append(('exists', " ".join(base_path + [p])))
+            found = iter(config.query_many(queries))
+            existing = [set(p for p in self._prefixes if next(found)) for b in base_paths]
+
+        queries = []
+        for base_path, prefixes in zip(base_paths, existing):
+            for f in self._fields:
+                if not self._is_skipped(f, prefixes):
+                    queries.append((_QUERY_OPS[f.type], " ".join(base_path + f.path)))
+        results = iter(config.query_many(queries))
+
+        config_hashes = []
+        tag_nodes = collections.defaultdict(list)
+        for base_path, prefixes in zip(base_paths, existing):
+            config_hash = {}
+            for f in self._fields:
+                if self._is_skipped(f, prefixes):
+                    config_hash[f.name] = _empty_value(f.type)
+                else:
+                    config_hash[f.name] = next(results)
+
+                if f.type == dict:
+                    nodes = config_hash[f.name]
+                    config_hash[f.name] = {}
+                    for node in nodes:
+                        tag_nodes[f.name].append((config_hash[f.name], node, base_path + f.path + [node]))
+            config_hashes.append(config_hash)
+
+        # Retrieve children of every tag node field in one go
+        for f in self._fields:
+            if f.type != dict:
+                continue
+            children = tag_nodes[f.name]
+            inner_hashes = f.plan._retrieve_many([c[2] for c in children], config)
+            for (tag_hash, node, _), inner_hash in zip(children, inner_hashes):
+                tag_hash[node] = inner_hash
+
+        return config_hashes
+
+
+def compile_description(path_hash):
+    """
+    Validates a declarative config description and prepares it for retrieving config dicts
 
-    Supported types are: ``str`` (for normal nodes),
-    ``list`` (returns a list of strings, for multi nodes),
-    ``bool`` (returns True if valueless node exists),
-    ``dict`` (for tag nodes, returns a dict indexed by node names,
-    according to description in the third item of the tuple).
+    See ``retrieve_config`` for the description format.
 
     Args:
         path_hash (dict): Declarative description of the config to retrieve
-        base_path (list): A base path to prepend to all option paths
-        config (vyos.config.Config): A VyOS config object
 
     Returns:
-        dict: config dict
+        RetrievalPlan: a plan that can be used with any config object
+
+    Raises:
+        ValueError: if the description is malformed
     """
-    config_hash = {}
+    fields = []
 
     for k in path_hash:
 
@@ -57,24 +181,45 @@ def retrieve_config(path_hash, base_path, config):
         if type(typ) != type:
             raise ValueError("In field {0}: type must be a type, not a {1}".format(k, type(typ)))
 
-        path = base_path + path
+        if typ not in _QUERY_OPS:
+            continue
 
-        path_str = " ".join(path)
-
-        if typ == str:
-            config_hash[k] = config.return_value(path_str)
-        elif typ == list:
-            config_hash[k] = config.return_values(path_str)
-        elif typ == bool:
-            config_hash[k] = config.exists(path_str)
-        elif typ == dict:
+        plan = None
+        if typ == dict:
             try:
                 inner_hash = path_hash[k][2]
             except IndexError:
                 raise ValueError("The type of the \'{0}\' field is dict, but inner options hash is missing from the tuple".format(k))
-            config_hash[k] = {}
-            nodes = config.list_nodes(path_str)
-            for node in nodes:
-                config_hash[k][node] = retrieve_config(inner_hash, path + [node], config)
+            plan = compile_description(inner_hash)
+
+        fields.append(_Field(k, path, typ, plan))
+
+    return RetrievalPlan(fields)
 
-    return config_hash
+
+def retrieve_config(path_hash, base_path, config):
+    """
+    Retrieves a VyOS config as a dict according to a declarative description
+
+    The description dict, passed in the first argument, must follow this format:
+    ``field_name : <path, type, [inner_options_dict]>``.
+
+    Supported types are: ``str`` (for normal nodes),
+    ``list`` (returns a list of strings, for multi nodes),
+    ``bool`` (returns True if valueless node exists),
+    ``dict`` (for tag nodes, returns a dict indexed by node names,
+    according to description in the third item of the tuple).
+
+    Args:
+        path_hash (dict): Declarative description of the config to retrieve
+        base_path (list): A base path to prepend to all option paths
+        config (vyos.config.Config): A VyOS config object
+
+    Returns:
+        dict: config dict
+
+    Note:
+        Scripts that retrieve the same description many times should
+        compile it once with ``compile_description`` and reuse the plan.
+    """
+    return compile_description(path_hash).retrieve(base_path, config)
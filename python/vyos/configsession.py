@@ -15,8 +15,11 @@
 import os
 import re
 import sys
+import shlex
 import subprocess
 
+import vyos.configtree
+
 CLI_SHELL_API = '/bin/cli-shell-api'
 SET = '/opt/vyatta/sbin/my_set'
 DELETE = '/opt/vyatta/sbin/my_delete'
@@ -24,6 +27,9 @@ COMMENT = '/opt/vyatta/sbin/my_comment'
 COMMIT = '/opt/vyatta/sbin/my_commit'
 DISCARD = '/opt/vyatta/sbin/my_discard'
 SHOW_CONFIG = ['/bin/cli-shell-api', 'showConfig']
+# The proposed config without diff markers, regardless of edit level
+SHOW_WORKING_CONFIG = ['/bin/cli-shell-api', '--show-working-only', '--show-show-defaults',
+                       '--show-ignore-edit', 'showConfig']
 
 # Default "commit via" string
 APP = "vyos-http-api"
@@ -63,6 +69,98 @@ def inject_vyos_env(env):
 
     return env
 
+# The injected environment is the same for all sessions, build it once
+_base_env = None
+
+# Session environments by session id, see get_session_env
+_session_envs = {}
+
+# Sessions created by get_session
+_sessions = {}
+
+def get_base_env():
+    """
+    Returns:
+        dict: a copy of the process environment with the VyOS environment injected
+    """
+    global _base_env
+    if _base_env is None:
+        _base_env = inject_vyos_env(dict(os.environ))
+    return _base_env
+
+def parse_session_env(env_str):
+    """
+    Extracts variable assignments from the shell code printed by
+    ``cli-shell-api getSessionEnv``.
+
+    Args:
+        env_str (str): shell code
+
+    Returns:
+        dict: variables and their values
+    """
+    lexer = shlex.shlex(env_str, posix=True, punctuation_chars=True)
+    env = {}
+    for token in lexer:
+        name, sep, value = token.partition('=')
+        if sep and re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', name):
+            env[name] = value
+    return env
+
+def get_session_env(session_id):
+    """
+    Returns the environment of a config session, running ``cli-shell-api getSessionEnv``
+    only the first time it is needed for a session id in this process.
+
+    Args:
+        session_id (str): Session identifier
+
+    Returns:
+        dict: environment with the VyOS and session variables, callers must not modify it
+    """
+    session_id = str(session_id)
+    if session_id not in _session_envs:
+        env_str = subprocess.check_output([CLI_SHELL_API, 'getSessionEnv', session_id])
+        env = dict(get_base_env())
+        env.update(parse_session_env(env_str.decode()))
+        _session_envs[session_id] = env
+    return _session_envs[session_id]
+
+def get_session(session_id, app=APP):
+    """
+    Returns a config session for the session identifier, reusing the session
+    created by an earlier call with the same identifier.
+
+    Scripts that need a session for just a few commands should use this
+    rather than create a ``ConfigSession`` every time, since session setup
+    is expensive.
+
+    Args:
+        session_id (str): Session identifier
+        app (str): Application name, only used when a new session is created
+
+    Returns:
+        ConfigSession: the session, which stays set up until ``close_session``
+        is called or the process exits
+    """
+    session_id = str(session_id)
+    if session_id not in _sessions:
+        _sessions[session_id] = ConfigSession(session_id, app=app)
+    return _sessions[session_id]
+
+def close_session(session_id):
+    """
+    Tears down a session returned by ``get_session`` and forgets it,
+    so that the next ``get_session`` call for the identifier sets up a new one.
+    Does nothing if there is no such session.
+
+    Args:
+        session_id (str): Session identifier
+    """
+    session = _sessions.pop(str(session_id), None)
+    if session is not None:
+        session.close()
+
 
 class ConfigSessionError(Exception):
     pass
@@ -84,26 +182,29 @@ class ConfigSession(object):
             The session identifier MUST be globally unique within the system.
             The best practice is to only have one ConfigSession object per process
             and used the PID for the session identifier.
+            ``get_session`` helps with that.
         """
 
-        env_str = subprocess.check_output([CLI_SHELL_API, 'getSessionEnv', str(session_id)])
         self.__session_id = session_id
 
-        # Extract actual variables from the chunk of shell it outputs
-        # XXX: it's better to extend cli-shell-api to provide easily readable output
-        env_list = re.findall(r'([A-Z_]+)=([^;\s]+)', env_str.decode())
-
-        session_env = os.environ
-        session_env = inject_vyos_env(session_env)
-        for k, v in env_list:
-            session_env[k] = v
-
-        self.__session_env = session_env
+        self.__session_env = dict(get_session_env(session_id))
         self.__session_env["COMMIT_VIA"] = app
 
+        self.__change_callbacks = []
+        self.__closed = False
+
         self.__run_command([CLI_SHELL_API, 'setupSession'])
 
     def __del__(self):
+        self.close()
+
+    def close(self):
+        """
+        Tears down the session. Does nothing if it's already closed.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
         try:
             output = subprocess.check_output([CLI_SHELL_API, 'teardownSession'], env=self.__session_env).decode().strip()
             if output:
@@ -119,22 +220,39 @@ class ConfigSession(object):
             raise ConfigSessionError(output)
         return output
 
+    def __notify_change(self):
+        for callback in self.__change_callbacks:
+            callback()
+
     def get_session_env(self):
         return self.__session_env
 
+    def add_change_callback(self, callback):
+        """
+        Register a function to call without arguments every time
+        this session modifies, commits, or discards changes.
+        """
+        self.__change_callbacks.append(callback)
+
     def set(self, path, value=None):
         if not value:
             value = []
         else:
             value = [value]
-        self.__run_command([SET] + path + value)
+        try:
+            self.__run_command([SET] + path + value)
+        finally:
+            self.__notify_change()
 
     def delete(self, path, value=None):
         if not value:
             value = []
         else:
             value = [value]
-        self.__run_command([DELETE] + path + value)
+        try:
+            self.__run_command([DELETE] + path + value)
+        finally:
+            self.__notify_change()
 
     def comment(self, path, value=None):
         if not value:
@@ -144,14 +262,60 @@ class ConfigSession(object):
         self.__run_command([COMMENT] + path + value)
 
     def commit(self):
-        self.__run_command([COMMIT])
+        try:
+            self.__run_command([COMMIT])
+        finally:
+            self.__notify_change()
 
     def discard(self):
-        self.__run_command([DISCARD])
+        try:
+            self.__run_command([DISCARD])
+        finally:
+            self.__notify_change()
 
     def show_config(self, path, format='raw'):
-        config_data = self.__run_command(SHOW_CONFIG + path)
+        """
+        Shows the proposed config of the session
+
+        Args:
+            path (list): Config path, or a list of config paths
+            format (str): ``raw`` for the text format, where uncommitted changes
+                are marked with ``+``, ``-``, and ``>`` like in ``show`` in the CLI,
+                ``json`` for dicts in the format of ``vyos.configtree.ConfigTree.to_dict``,
+                or ``commands`` for set commands
+
+        Returns:
+            the subtree, or a list of subtrees if a list of paths was given
+
+        Raises:
+            ConfigSessionError: if a path does not exist
+
+        Note:
+            All paths in the ``json`` and ``commands`` formats are read from
+            the same copy of the config, so it takes only one ``cli-shell-api`` call.
+        """
+        multi = bool(path) and isinstance(path[0], list)
+        paths = path if multi else [path]
 
         if format == 'raw':
-            return config_data
+            res = [self.__run_command(SHOW_CONFIG + p) for p in paths]
+        elif format in ['json', 'commands']:
+            config_data = self.__run_command(SHOW_WORKING_CONFIG)
+            tree = None
+            if config_data.strip():
+                # showConfig does not escape backslashes, which configtree expects; cf. T1001
+                tree = vyos.configtree.ConfigTree(config_data.replace("\\", "\\\\"))
+
+            res = []
+            for p in paths:
+                if p and ((tree is None) or (not tree.exists(p))):
+                    raise ConfigSessionError("Path [{0}] doesn't exist".format(" ".join(p)))
+                if format == 'json':
+                    res.append(tree.to_dict(p) if tree else {})
+                else:
+                    res.append("".join(tree.iter_commands(p)) if tree else "")
+        else:
+            raise ConfigSessionError("\"{0}\" is not a valid config format".format(format))
+
+        return res if multi else res[0]
 
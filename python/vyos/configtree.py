@@ -12,64 +12,72 @@
 # You should have received a copy of the GNU Lesser General Public License along with this library;
 # if not, write to the Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA 
 
-import re
+import os
 import json
+import mmap
+import threading
+import collections
 
-from ctypes import cdll, c_char_p, c_void_p, c_int
+from ctypes import cdll, c_char, c_char_p, c_void_p, c_int, c_bool
 
 
 def strip_comments(s):
     """ Split a config string into the config section and the trailing comments """
-    INITIAL = 0
-    IN_COMMENT = 1
+    i = len(s)
 
-    i = len(s) - 1
+    # Skip trailing whitespace and comments, from the end to the start,
+    # until the last character of the config section
+    while True:
+        while (i > 0) and s[i-1].isspace():
+            i -= 1
 
-    state = INITIAL
+        if (i == 0) or (s[i-1] != '/'):
+            # Either there is no config section at all,
+            # or it's an end of a node: a brace or the last character of a leaf node value
+            config_end = i
+            break
 
-    config_end = 0
+        # A comment ends here, or it's a stray slash
+        if s[i-2] != '*':
+            raise ValueError("Invalid syntax: stray slash at character {0}".format(i))
 
-    # Find the first character of the comments section at the end,
-    # if it exists
-    while (i >= 0):
-        c = s[i]
+        # Everything inside comments is ignored, including braces
+        comment_start = s.rfind('/*', 0, i - 2)
+        if comment_start < 0:
+            raise ValueError("Invalid syntax: malformed comment end at character {0}".format(i - 1))
+        i = comment_start
 
-        if (state == INITIAL) and re.match(r'\s', c):
-            # Ignore whitespace
-            if (i != 0):
-                i -= 1
-            else:
-                config_end = 0
-                break
-        elif (state == INITIAL) and not re.match(r'(\s|\/)', c):
-            # Assume there are no (more) trailing comments,
-            # this is an end of a node: either a brace of the last character
-            # of a leaf node value
-            config_end = i + 1
-            break
-        elif (state == INITIAL) and (c == '/'):
-            # A comment begins, or it's a stray slash
-            if (s[i-1] == '*'):
-                state = IN_COMMENT
-                i -= 2
-            else:
-                raise ValueError("Invalid syntax: stray slash at character {0}".format(i + 1))
-        elif (state == IN_COMMENT) and (c == '*'):
-            # A comment ends here
-            try:
-                if (s[i-1] == '/'):
-                    state = INITIAL
-                    i -= 2
-            except:
-                raise ValueError("Invalid syntax: malformed commend end at character {0}".format(i + 1))
-        elif (state == IN_COMMENT) and (c != '*'):
-            # Ignore everything inside comments, including braces
-            i -= 1
+    return (s[0:config_end], s[config_end+1:])
+
+def split_buffer(buf, size):
+    """
+    Find where the trailing comments start in a bytes-like config buffer
+    without decoding all of it
+
+    Returns:
+        tuple: config section length in bytes, and the comments string
+    """
+    window = 65536
+    while True:
+        start = max(0, size - window)
+        # Only ASCII characters matter for the comment syntax, and replacing every other byte
+        # with a single character keeps offsets in the decoded string equal to byte offsets
+        tail = bytes(buf[start:size]).decode('ascii', errors='replace')
+        try:
+            config_section, comments_section = strip_comments(tail)
+        except ValueError:
+            # The window may begin in the middle of a comment
+            if start == 0:
+                raise
         else:
-            # Shouldn't happen
-            raise ValueError("Invalid syntax at character {0}: invalid character {1}".format(i + 1, c))
+            if config_section or (start == 0):
+                config_end = start + len(config_section)
+                return (config_end, bytes(buf[config_end+1:size]).decode())
+        window *= 4
 
-    return (s[0:config_end], s[config_end+1:])
+def quote_command_value(value):
+    # A single quote can't be escaped inside single quotes, it has to end the quoted string
+    return "'{0}'".format(value.replace("'", "'\\''"))
 
 def check_path(path):
     # Necessary type checking
@@ -83,87 +91,144 @@ class ConfigTreeError(Exception):
     pass
 
 
-class ConfigTree(object):
-    def __init__(self, config_string, libpath='/usr/lib/libvyosconfig.so.0'):
-        self.__config = None
-        self.__lib = cdll.LoadLibrary(libpath)
-
-        # Import functions
-        self.__from_string = self.__lib.from_string
-        self.__from_string.argtypes = [c_char_p]
-        self.__from_string.restype = c_void_p
-
-        self.__get_error = self.__lib.get_error
-        self.__get_error.argtypes = []
-        self.__get_error.restype = c_char_p
-
-        self.__to_string = self.__lib.to_string
-        self.__to_string.argtypes = [c_void_p]
-        self.__to_string.restype = c_char_p
-
-        self.__to_commands = self.__lib.to_commands
-        self.__to_commands.argtypes = [c_void_p]
-        self.__to_commands.restype = c_char_p
-
-        self.__set_add_value = self.__lib.set_add_value
-        self.__set_add_value.argtypes = [c_void_p, c_char_p, c_char_p]
-        self.__set_add_value.restype = c_int
-
-        self.__delete_value = self.__lib.delete_value
-        self.__delete_value.argtypes = [c_void_p, c_char_p, c_char_p]
-        self.__delete_value.restype = c_int
-
-        self.__delete = self.__lib.delete_node
-        self.__delete.argtypes = [c_void_p, c_char_p]
-        self.__delete.restype = c_int
+# Attribute name, library symbol, argument types, return type
+_LIB_FUNCTIONS = [
+    ('from_string', 'from_string', [c_char_p], c_void_p),
+    ('get_error', 'get_error', [], c_char_p),
+    ('to_string', 'to_string', [c_void_p], c_char_p),
+    ('to_commands', 'to_commands', [c_void_p], c_char_p),
+    ('set_add_value', 'set_add_value', [c_void_p, c_char_p, c_char_p], c_int),
+    ('delete_value', 'delete_value', [c_void_p, c_char_p, c_char_p], c_int),
+    ('delete', 'delete_node', [c_void_p, c_char_p], c_int),
+    ('rename', 'rename_node', [c_void_p, c_char_p, c_char_p], c_int),
+    ('copy', 'copy_node', [c_void_p, c_char_p, c_char_p], c_int),
+    ('set_replace_value', 'set_replace_value', [c_void_p, c_char_p, c_char_p], c_int),
+    ('set_valueless', 'set_valueless', [c_void_p, c_char_p], c_int),
+    ('exists', 'exists', [c_void_p, c_char_p], c_int),
+    ('list_nodes', 'list_nodes', [c_void_p, c_char_p], c_char_p),
+    ('return_value', 'return_value', [c_void_p, c_char_p], c_char_p),
+    ('return_values', 'return_values', [c_void_p, c_char_p], c_char_p),
+    ('is_tag', 'is_tag', [c_void_p, c_char_p], c_int),
+    ('set_tag', 'set_tag', [c_void_p, c_char_p], c_int),
+    ('destroy', 'destroy', [c_void_p], None),
+]
+
+# Bulk export functions are only available in newer libvyosconfig versions,
+# they are set to None if the library doesn't have them
+_OPTIONAL_LIB_FUNCTIONS = [
+    ('to_json', 'to_json', [c_void_p], c_char_p),
+    ('get_subtree', 'get_subtree', [c_void_p, c_char_p, c_bool], c_void_p),
+]
+
+_libraries = {}
+
+# ctypes releases the GIL for library calls, and libvyosconfig is not known
+# to be safe to call from several threads at once, so calls take turns
+_library_lock = threading.Lock()
+
+
+def _serialized(func):
+    def wrapper(*args):
+        with _library_lock:
+            return func(*args)
+    return wrapper
+
+
+class _Library(object):
+    pass
 
-        self.__rename = self.__lib.rename_node
-        self.__rename.argtypes = [c_void_p, c_char_p, c_char_p]
-        self.__rename.restype = c_int
 
-        self.__copy = self.__lib.copy_node
-        self.__copy.argtypes = [c_void_p, c_char_p, c_char_p]
-        self.__copy.restype = c_int
+def get_library(libpath='/usr/lib/libvyosconfig.so.0'):
+    """
+    Load libvyosconfig and set up its function prototypes
 
-        self.__set_replace_value = self.__lib.set_replace_value
-        self.__set_replace_value.argtypes = [c_void_p, c_char_p, c_char_p]
-        self.__set_replace_value.restype = c_int
+    This is done once per process for every library path,
+    all ConfigTree objects share the result.
+    """
+    try:
+        return _libraries[libpath]
+    except KeyError:
+        pass
 
-        self.__set_valueless = self.__lib.set_valueless
-        self.__set_valueless.argtypes = [c_void_p, c_char_p]
-        self.__set_valueless.restype = c_int
+    so = cdll.LoadLibrary(libpath)
+    lib = _Library()
 
-        self.__exists = self.__lib.exists
-        self.__exists.argtypes = [c_void_p, c_char_p]
-        self.__exists.restype = c_int
+    def import_function(name, symbol, argtypes, restype):
+        func = getattr(so, symbol)
+        func.argtypes = argtypes
+        func.restype = restype
+        setattr(lib, name, _serialized(func))
 
-        self.__list_nodes = self.__lib.list_nodes
-        self.__list_nodes.argtypes = [c_void_p, c_char_p]
-        self.__list_nodes.restype = c_char_p
+    for f in _LIB_FUNCTIONS:
+        import_function(*f)
 
-        self.__return_value = self.__lib.return_value
-        self.__return_value.argtypes = [c_void_p, c_char_p]
-        self.__return_value.restype = c_char_p
+    for f in _OPTIONAL_LIB_FUNCTIONS:
+        try:
+            import_function(*f)
+        except AttributeError:
+            setattr(lib, f[0], None)
 
-        self.__return_values = self.__lib.return_values
-        self.__return_values.argtypes = [c_void_p, c_char_p]
-        self.__return_values.restype = c_char_p
+    _libraries[libpath] = lib
+    return lib
 
-        self.__is_tag = self.__lib.is_tag
-        self.__is_tag.argtypes = [c_void_p, c_char_p]
-        self.__is_tag.restype = c_int
 
-        self.__set_tag = self.__lib.set_tag
-        self.__set_tag.argtypes = [c_void_p, c_char_p]
-        self.__set_tag.restype = c_int
+class ConfigTree(object):
+    def __init__(self, config_string, libpath='/usr/lib/libvyosconfig.so.0'):
+        self.__config = None
+        self.__comments = ""
+        self.__lib = get_library(libpath)
+
+        if config_string is not None:
+            config_section, comments_section = strip_comments(config_string)
+            self.__load(config_section.encode(), comments_section)
+
+    @classmethod
+    def from_file(cls, file_name, libpath='/usr/lib/libvyosconfig.so.0'):
+        """
+        Load a config tree from a file
+
+        The file is memory-mapped and handed to the parser as is,
+        without reading it into a Python string first.
+
+        Args:
+            file_name (str): config file path
+
+        Returns:
+            ConfigTree: parsed config
+
+        Raises:
+            OSError: if the file cannot be read
+            ValueError: if the file cannot be parsed
+        """
+        with open(file_name, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return cls('', libpath=libpath)
+            # Private copy-on-write mapping, changes never reach the file
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        try:
+            config_end, comments_section = split_buffer(buf, size)
+            tree = cls(None, libpath=libpath)
+            if config_end < size:
+                # The parser expects a NUL-terminated string
+                buf[config_end] = 0
+                config_section = (c_char * size).from_buffer(buf)
+                try:
+                    tree.__load(config_section, comments_section)
+                finally:
+                    del config_section
+            else:
+                tree.__load(buf[:config_end], comments_section)
+        finally:
+            buf.close()
 
-        self.__destroy = self.__lib.destroy
-        self.__destroy.argtypes = [c_void_p]
+        return tree
 
-        config_section, comments_section = strip_comments(config_string)
-        config = self.__from_string(config_section.encode())
+    def __load(self, config_section, comments_section):
+        config = self.__lib.from_string(config_section)
         if config is None:
-            msg = self.__get_error().decode()
+            msg = self.__lib.get_error().decode()
             raise ValueError("Failed to parse config: {0}".format(msg))
         else:
             self.__config = config
@@ -171,42 +236,180 @@ class ConfigTree(object):
 
     def __del__(self):
         if self.__config is not None:
-            self.__destroy(self.__config)
+            self.__lib.destroy(self.__config)
 
     def __str__(self):
         return self.to_string()
 
     def to_string(self):
-        config_string = self.__to_string(self.__config).decode()
+        config_string = self.__lib.to_string(self.__config).decode()
         config_string = "{0}\n{1}".format(config_string, self.__comments)
         return config_string
 
     def to_commands(self):
-        return self.__to_commands(self.__config).decode()
+        return self.__lib.to_commands(self.__config).decode()
+
+    def to_json(self, path=[]):
+        """
+        Serialize a subtree to JSON.
+
+        Leaf nodes with one value become strings, nodes with multiple values become lists,
+        and valueless nodes become empty objects. Tag node children are keyed by their names.
+
+        Args:
+            path (list): Path of the subtree, or empty for the whole config
+
+        Returns:
+            str: JSON string
+
+        Raises:
+            ConfigTreeError: if the path does not exist
+        """
+        check_path(path)
+
+        if self.__lib.to_json is None or (path and self.__lib.get_subtree is None):
+            return json.dumps(self.to_dict(path))
+
+        if not path:
+            return self.__lib.to_json(self.__config).decode()
+
+        if not self.exists(path):
+            raise ConfigTreeError("Path [{}] doesn't exist".format(" ".join(path)))
+        path_str = " ".join(map(str, path)).encode()
+        subtree = self.__lib.get_subtree(self.__config, path_str, False)
+        try:
+            return self.__lib.to_json(subtree).decode()
+        finally:
+            self.__lib.destroy(subtree)
+
+    def to_dict(self, path=[]):
+        """
+        Convert a subtree to nested dicts, see ``to_json`` for the format.
+
+        Args:
+            path (list): Path of the subtree, or empty for the whole config
+
+        Returns:
+            dict: subtree contents
+
+        Raises:
+            ConfigTreeError: if the path does not exist
+        """
+        check_path(path)
+
+        if self.__lib.to_json is not None and (not path or self.__lib.get_subtree is not None):
+            return json.loads(self.to_json(path))
+
+        if path and not self.exists(path):
+            raise ConfigTreeError("Path [{}] doesn't exist".format(" ".join(path)))
+        return self.__subtree_to_dict(path)
+
+    def __subtree_to_dict(self, path):
+        # Fallback for libvyosconfig versions without to_json
+        res = {}
+        for name in self.list_nodes(path):
+            node_path = path + [name]
+            if self.list_nodes(node_path):
+                res[name] = self.__subtree_to_dict(node_path)
+            else:
+                values = self.return_values(node_path)
+                if not values:
+                    res[name] = {}
+                elif len(values) == 1:
+                    res[name] = values[0]
+                else:
+                    res[name] = values
+        return res
+
+    def iter_json(self, path=[]):
+        """
+        Serialize a subtree to JSON piece by piece, without building
+        the whole string in memory. The output is the same as ``json.dumps(self.to_dict(path))``.
+
+        Args:
+            path (list): Path of the subtree, or empty for the whole config
+
+        Yields:
+            str: parts of the JSON string
+
+        Raises:
+            ConfigTreeError: if the path does not exist
+        """
+        check_path(path)
+        if path and not self.exists(path):
+            raise ConfigTreeError("Path [{}] doesn't exist".format(" ".join(path)))
+        yield from self.__iter_json(path)
+
+    def __iter_json(self, path):
+        yield '{'
+        for i, name in enumerate(self.list_nodes(path)):
+            node_path = path + [name]
+            yield '{0}{1}: '.format(', ' if i else '', json.dumps(name))
+            if self.list_nodes(node_path):
+                yield from self.__iter_json(node_path)
+            else:
+                values = self.return_values(node_path)
+                if not values:
+                    yield '{}'
+                elif len(values) == 1:
+                    yield json.dumps(values[0])
+                else:
+                    yield json.dumps(values)
+        yield '}'
+
+    def iter_commands(self, path=[]):
+        """
+        Generate set commands that recreate a subtree, one by one.
+
+        Args:
+            path (list): Path of the subtree, or empty for the whole config
+
+        Yields:
+            str: set commands with full paths, each followed by a newline
+
+        Raises:
+            ConfigTreeError: if the path does not exist
+        """
+        check_path(path)
+        if path and not self.exists(path):
+            raise ConfigTreeError("Path [{}] doesn't exist".format(" ".join(path)))
+        yield from self.__iter_commands(path)
+
+    def __iter_commands(self, path):
+        for name in self.list_nodes(path):
+            node_path = path + [name]
+            if self.list_nodes(node_path):
+                yield from self.__iter_commands(node_path)
+            else:
+                values = self.return_values(node_path)
+                if not values:
+                    yield "set {0}\n".format(" ".join(node_path))
+                for v in values:
+                    yield "set {0} {1}\n".format(" ".join(node_path), quote_command_value(v))
 
     def set(self, path, value=None, replace=True):
         check_path(path)
         path_str = " ".join(map(str, path)).encode()
 
         if value is None:
-            self.__set_valueless(self.__config, path_str)
+            self.__lib.set_valueless(self.__config, path_str)
         else:
             if replace:
-                self.__set_replace_value(self.__config, path_str, str(value).encode())
+                self.__lib.set_replace_value(self.__config, path_str, str(value).encode())
             else:
-                self.__set_add_value(self.__config, path_str, str(value).encode())
+                self.__lib.set_add_value(self.__config, path_str, str(value).encode())
 
     def delete(self, path):
         check_path(path)
         path_str = " ".join(map(str, path)).encode()
 
-        self.__delete(self.__config, path_str)
+        self.__lib.delete(self.__config, path_str)
 
     def delete_value(self, path, value):
         check_path(path)
         path_str = " ".join(map(str, path)).encode()
 
-        self.__delete_value(self.__config, path_str, value.encode())
+        self.__lib.delete_value(self.__config, path_str, value.encode())
 
     def rename(self, path, new_name):
         check_path(path)
@@ -217,7 +420,7 @@ class ConfigTree(object):
         new_path = path[:-1] + [new_name]
         if self.exists(new_path):
             raise ConfigTreeError()
-        res = self.__rename(self.__config, path_str, newname_str)
+        res = self.__lib.rename(self.__config, path_str, newname_str)
         if (res != 0):
             raise ConfigTreeError("Path [{}] doesn't exist".format(oldpath))
 
@@ -230,7 +433,7 @@ class ConfigTree(object):
         # Check if a node with intended new name already exists
         if self.exists(new_path):
             raise ConfigTreeError()
-        res = self.__copy(self.__config, oldpath_str, newpath_str)
+        res = self.__lib.copy(self.__config, oldpath_str, newpath_str)
         if (res != 0):
             raise ConfigTreeError("Path [{}] doesn't exist".format(oldpath))
 
@@ -238,7 +441,7 @@ class ConfigTree(object):
         check_path(path)
         path_str = " ".join(map(str, path)).encode()
 
-        res = self.__exists(self.__config, path_str)
+        res = self.__lib.exists(self.__config, path_str)
         if (res == 0):
             return False
         else:
@@ -248,7 +451,7 @@ class ConfigTree(object):
         check_path(path)
         path_str = " ".join(map(str, path)).encode()
 
-        res_json = self.__list_nodes(self.__config, path_str).decode()
+        res_json = self.__lib.list_nodes(self.__config, path_str).decode()
         res = json.loads(res_json)
 
         if res is None:
@@ -260,7 +463,7 @@ class ConfigTree(object):
         check_path(path)
         path_str = " ".join(map(str, path)).encode()
 
-        res_json = self.__return_value(self.__config, path_str).decode()
+        res_json = self.__lib.return_value(self.__config, path_str).decode()
         res = json.loads(res_json)
 
         if res is None:
@@ -272,7 +475,7 @@ class ConfigTree(object):
         check_path(path)
         path_str = " ".join(map(str, path)).encode()
 
-        res_json = self.__return_values(self.__config, path_str).decode()
+        res_json = self.__lib.return_values(self.__config, path_str).decode()
         res = json.loads(res_json)
 
         if res is None:
@@ -284,7 +487,7 @@ class ConfigTree(object):
         check_path(path)
         path_str = " ".join(map(str, path)).encode()
 
-        res = self.__is_tag(self.__config, path_str)
+        res = self.__lib.is_tag(self.__config, path_str)
         if (res >= 1):
             return True
         else:
@@ -294,9 +497,68 @@ class ConfigTree(object):
         check_path(path)
         path_str = " ".join(map(str, path)).encode()
 
-        res = self.__set_tag(self.__config, path_str)
+        res = self.__lib.set_tag(self.__config, path_str)
         if (res == 0):
             return True
         else:
             raise ConfigTreeError("Path [{}] doesn't exist".format(path_str))
 
+
+
+DiffEntry = collections.namedtuple('DiffEntry', ['kind', 'path', 'old', 'new'])
+DiffEntry.__doc__ = """
+A difference between two config trees
+
+``kind`` is one of ``DIFF_ADDED``, ``DIFF_REMOVED``, or ``DIFF_CHANGED``,
+``path`` is a node path, ``old`` and ``new`` are the node contents
+in the format of ``ConfigTree.to_dict``, or None if the node doesn't exist.
+"""
+
+DIFF_ADDED = 'added'
+DIFF_REMOVED = 'removed'
+DIFF_CHANGED = 'changed'
+
+
+def _diff_dicts(old, new, path):
+    for name in old:
+        node_path = path + [name]
+        if name not in new:
+            yield DiffEntry(DIFF_REMOVED, node_path, old[name], None)
+        elif isinstance(old[name], dict) and isinstance(new[name], dict):
+            yield from _diff_dicts(old[name], new[name], node_path)
+        elif old[name] != new[name]:
+            yield DiffEntry(DIFF_CHANGED, node_path, old[name], new[name])
+
+    for name in new:
+        if name not in old:
+            yield DiffEntry(DIFF_ADDED, path + [name], None, new[name])
+
+
+def diff_trees(old_tree, new_tree, path=[]):
+    """
+    Find differences between two config trees
+
+    Both trees are walked in parallel once, and differences are generated as they are found.
+    A node that only exists in one of the trees is reported as a whole, without its children.
+
+    Args:
+        old_tree (ConfigTree): old config, e.g. the running config
+        new_tree (ConfigTree): new config, e.g. the proposed config
+        path (list): path of the subtrees to compare, or empty for the whole config
+
+    Returns:
+        generator: DiffEntry tuples
+    """
+    check_path(path)
+
+    old = old_tree.to_dict(path) if old_tree.exists(path) or not path else None
+    new = new_tree.to_dict(path) if new_tree.exists(path) or not path else None
+
+    if old is None and new is None:
+        return
+    elif old is None:
+        yield DiffEntry(DIFF_ADDED, path, None, new)
+    elif new is None:
+        yield DiffEntry(DIFF_REMOVED, path, old, None)
+    else:
+        yield from _diff_dicts(old, new, path)
@@ -17,9 +17,12 @@
 directories = {
   "data": "/usr/share/vyos/",
   "conf_mode": "/usr/libexec/vyos/conf_mode",
+  "validators": "/usr/libexec/vyos/validators",
+  "templates": "/opt/vyatta/share/vyatta-cfg/templates",
   "config": "/opt/vyatta/etc/config",
   "current": "/opt/vyatta/etc/config-migrate/current",
   "migrate": "/opt/vyatta/etc/config-migrate/migrate",
+  "migrate_cache": "/var/cache/vyos/config-migrate",
 }
 
 cfg_group = 'vyattacfg'
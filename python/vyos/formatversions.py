@@ -18,17 +18,36 @@ import os
 import re
 import fileinput
 
+# Version footer lines, see write_vyatta_versions_foot and write_vyos_versions_foot
+vyatta_version_re = re.compile(r'/\* === vyatta-config-version:.+=== \*/$')
+vyatta_version_valid_re = re.compile(r'/\* === vyatta-config-version:\s+"([\w,-]+@\d+:)+([\w,-]+@\d+)"\s+=== \*/$')
+vyos_version_re = re.compile(r'// vyos-config-version:.+')
+vyos_version_valid_re = re.compile(r'// vyos-config-version:\s+"([\w,-]+@\d+:)+([\w,-]+@\d+)"\s*')
+version_pair_re = re.compile(r'([\w,-]+)@(\d+)')
+
+footer_res = [
+    re.compile(r'/\* Warning:.+ \*/$'),
+    vyatta_version_re,
+    re.compile(r'/\* Release version:.+ \*/$'),
+    vyos_version_re,
+    re.compile('// Warning:.+'),
+    re.compile('// Release version:.+')
+]
+
+# How much of the end of the file to read first when looking for the footer
+TAIL_SIZE = 4096
+
 def read_vyatta_versions(config_file):
     config_file_versions = {}
 
     with open(config_file, 'r') as config_file_handle:
         for config_line in config_file_handle:
-            if re.match(r'/\* === vyatta-config-version:.+=== \*/$', config_line):
-                if not re.match(r'/\* === vyatta-config-version:\s+"([\w,-]+@\d+:)+([\w,-]+@\d+)"\s+=== \*/$', config_line):
+            if vyatta_version_re.match(config_line):
+                if not vyatta_version_valid_re.match(config_line):
                     raise ValueError("malformed configuration string: "
                             "{}".format(config_line))
 
-                for pair in re.findall(r'([\w,-]+)@(\d+)', config_line):
+                for pair in version_pair_re.findall(config_line):
                     config_file_versions[pair[0]] = int(pair[1])
 
 
@@ -39,12 +58,12 @@ def read_vyos_versions(config_file):
 
     with open(config_file, 'r') as config_file_handle:
         for config_line in config_file_handle:
-            if re.match(r'// vyos-config-version:.+', config_line):
-                if not re.match(r'// vyos-config-version:\s+"([\w,-]+@\d+:)+([\w,-]+@\d+)"\s*', config_line):
+            if vyos_version_re.match(config_line):
+                if not vyos_version_valid_re.match(config_line):
                     raise ValueError("malformed configuration string: "
                             "{}".format(config_line))
 
-                for pair in re.findall(r'([\w,-]+)@(\d+)', config_line):
+                for pair in version_pair_re.findall(config_line):
                     config_file_versions[pair[0]] = int(pair[1])
 
     return config_file_versions
@@ -54,20 +73,122 @@ def remove_versions(config_file):
     Remove old version string.
     """
     for line in fileinput.input(config_file, inplace=True):
-        if re.match(r'/\* Warning:.+ \*/$', line):
-            continue
-        if re.match(r'/\* === vyatta-config-version:.+=== \*/$', line):
-            continue
-        if re.match(r'/\* Release version:.+ \*/$', line):
-            continue
-        if re.match('// vyos-config-version:.+', line):
-            continue
-        if re.match('// Warning:.+', line):
-            continue
-        if re.match('// Release version:.+', line):
+        if is_footer_line(line):
             continue
         sys.stdout.write(line)
 
+def is_footer_line(line):
+    return any(r.match(line) for r in footer_res)
+
+def read_footer(config_file_handle):
+    """
+    Find the version footer at the end of a file opened in binary mode,
+    reading only the end of the file.
+
+    The footer is the block of version lines, and empty lines between them,
+    that the file ends with.
+
+    Returns:
+        tuple: offset of the footer in the file, and a list of its lines
+    """
+    size = config_file_handle.seek(0, os.SEEK_END)
+    tail_size = TAIL_SIZE
+
+    while True:
+        start = max(0, size - tail_size)
+        config_file_handle.seek(start)
+        data = config_file_handle.read()
+
+        if start > 0:
+            # The first line may be incomplete
+            first_line_end = data.find(b'\n') + 1
+            if first_line_end == 0:
+                tail_size *= 2
+                continue
+            start += first_line_end
+            data = data[first_line_end:]
+
+        lines = data.decode(errors='surrogateescape').split('\n')
+        lines = [l + '\n' for l in lines[:-1]] + [l for l in lines[-1:] if l]
+        footer_start = len(lines)
+        while footer_start > 0:
+            line = lines[footer_start - 1]
+            if line.strip() and not is_footer_line(line):
+                break
+            footer_start -= 1
+
+        if footer_start == 0 and start > 0:
+            # The footer may start before the part we've read
+            tail_size *= 2
+            continue
+
+        offset = start + sum(len(l.encode(errors='surrogateescape')) for l in lines[:footer_start])
+        return offset, lines[footer_start:]
+
+def parse_versions(config_line):
+    return {name: int(version) for name, version in version_pair_re.findall(config_line)}
+
+def read_versions_footer(config_file):
+    """
+    Read component versions from the footer of a config file,
+    see ``read_footer``.
+
+    Returns:
+        tuple: vintage, 'vyos' or 'vyatta', or None if there's no version string,
+        and a dictionary of component versions
+    """
+    vyatta_versions = {}
+    vyos_versions = {}
+
+    with open(config_file, 'rb') as config_file_handle:
+        offset, lines = read_footer(config_file_handle)
+
+    for config_line in lines:
+        if vyatta_version_re.match(config_line):
+            if not vyatta_version_valid_re.match(config_line):
+                raise ValueError("malformed configuration string: "
+                        "{}".format(config_line))
+            vyatta_versions.update(parse_versions(config_line))
+        elif vyos_version_re.match(config_line):
+            if not vyos_version_valid_re.match(config_line):
+                raise ValueError("malformed configuration string: "
+                        "{}".format(config_line))
+            vyos_versions.update(parse_versions(config_line))
+
+    if vyos_versions:
+        return 'vyos', vyos_versions
+    if vyatta_versions:
+        return 'vyatta', vyatta_versions
+    return None, {}
+
+def write_versions_footer(config_file, vintage, component_version_string,
+                          os_version_string):
+    """
+    Replace the version footer of a config file, see ``read_footer``.
+
+    Only the footer is rewritten, the rest of the file is left as is.
+    The result is the same as that of ``remove_versions`` followed by
+    ``write_vyatta_versions_foot`` or ``write_vyos_versions_foot``.
+    """
+    if vintage == 'vyatta':
+        footer = format_vyatta_versions_foot(component_version_string, os_version_string)
+    elif vintage == 'vyos':
+        footer = format_vyos_versions_foot(component_version_string, os_version_string)
+    else:
+        raise ValueError("Unknown vintage: {}".format(vintage))
+
+    with open(config_file, 'r+b') as config_file_handle:
+        offset, lines = read_footer(config_file_handle)
+        # Keep the empty lines, like remove_versions does
+        lines = [l for l in lines if not is_footer_line(l)]
+        tail = "".join(lines) + footer
+
+        config_file_handle.seek(offset)
+        config_file_handle.write(tail.encode(errors='surrogateescape'))
+        config_file_handle.truncate()
+        config_file_handle.flush()
+        os.fsync(config_file_handle.fileno())
+
 def format_versions_string(config_versions):
     cfg_keys = list(config_versions.keys())
     cfg_keys.sort()
@@ -83,27 +204,30 @@ def format_versions_string(config_versions):
 
     return component_version_string
 
+def format_vyatta_versions_foot(component_version_string, os_version_string):
+    return ('/* Warning: Do not remove the following line. */\n'
+            '/* === vyatta-config-version: "{}" === */\n'
+            '/* Release version: {} */\n').format(component_version_string, os_version_string)
+
+def format_vyos_versions_foot(component_version_string, os_version_string):
+    return ('// Warning: Do not remove the following line.\n'
+            '// vyos-config-version: "{}"\n'
+            '// Release version: {}\n').format(component_version_string, os_version_string)
+
 def write_vyatta_versions_foot(config_file, component_version_string,
                                  os_version_string):
+    footer = format_vyatta_versions_foot(component_version_string, os_version_string)
     if config_file:
         with open(config_file, 'a') as config_file_handle:
-            config_file_handle.write('/* Warning: Do not remove the following line. */\n')
-            config_file_handle.write('/* === vyatta-config-version: "{}" === */\n'.format(component_version_string))
-            config_file_handle.write('/* Release version: {} */\n'.format(os_version_string))
+            config_file_handle.write(footer)
     else:
-        sys.stdout.write('/* Warning: Do not remove the following line. */\n')
-        sys.stdout.write('/* === vyatta-config-version: "{}" === */\n'.format(component_version_string))
-        sys.stdout.write('/* Release version: {} */\n'.format(os_version_string))
+        sys.stdout.write(footer)
 
 def write_vyos_versions_foot(config_file, component_version_string,
                                os_version_string):
+    footer = format_vyos_versions_foot(component_version_string, os_version_string)
     if config_file:
         with open(config_file, 'a') as config_file_handle:
-            config_file_handle.write('// Warning: Do not remove the following line.\n')
-            config_file_handle.write('// vyos-config-version: "{}"\n'.format(component_version_string))
-            config_file_handle.write('// Release version: {}\n'.format(os_version_string))
+            config_file_handle.write(footer)
     else:
-        sys.stdout.write('// Warning: Do not remove the following line.\n')
-        sys.stdout.write('// vyos-config-version: "{}"\n'.format(component_version_string))
-        sys.stdout.write('// Release version: {}\n'.format(os_version_string))
-
+        sys.stdout.write(footer)
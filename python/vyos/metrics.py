@@ -0,0 +1,170 @@
+# Copyright 2019 VyOS maintainers and contributors <maintainers@vyos.io>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Minimal counters and histograms for VyOS services, exported in the Prometheus
+text format, so that services can expose them without extra dependencies.
+
+Example:
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests handled', ['route'])
+    latency = registry.histogram('latency_seconds', 'Request latency', ['route'])
+
+    requests.inc(route='/retrieve')
+    with latency.time(route='/retrieve'):
+        ...
+
+    print(registry.render())
+
+All methods are thread-safe.
+"""
+
+import time
+import threading
+import contextlib
+
+
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=[]):
+    pairs = list(zip(names, values)) + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(n, _escape(v)) for n, v in pairs) + '}'
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    _type = None
+
+    def __init__(self, name, help, labels=[]):
+        self.name = name
+        self.help = help
+        self.labels = list(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError("Metric {0} needs labels {1}, got {2}".format(self.name, self.labels, sorted(labels)))
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.help.replace('\\', '\\\\').replace('\n', '\\n')),
+                 '# TYPE {0} {1}'.format(self.name, self._type)]
+        with self._lock:
+            for key in sorted(self._values):
+                lines += self._render_value(key, self._values[key])
+        return lines
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up, like the number of errors.
+    """
+    _type = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def _render_value(self, key, value):
+        return ['{0}{1} {2}'.format(self.name, _format_labels(self.labels, key), _format_number(value))]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, like request latencies,
+    counted in cumulative buckets.
+    """
+    _type = 'histogram'
+
+    def __init__(self, name, help, labels=[], buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = sorted(buckets) + [float('inf')]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            data = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data['buckets'][i] += 1
+                    break
+            data['sum'] += value
+            data['count'] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """
+        Observes the time in seconds it takes to run the ``with`` block.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def _render_value(self, key, data):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets, data['buckets']):
+            total += count
+            labels = _format_labels(self.labels, key, [('le', _format_number(bound))])
+            lines.append('{0}_bucket{1} {2}'.format(self.name, labels, total))
+        labels = _format_labels(self.labels, key)
+        lines.append('{0}_sum{1} {2}'.format(self.name, labels, _format_number(data['sum'])))
+        lines.append('{0}_count{1} {2}'.format(self.name, labels, data['count']))
+        return lines
+
+
+class Registry(object):
+    """
+    A set of metrics that are rendered together.
+    """
+    def __init__(self):
+        self.__metrics = []
+
+    def counter(self, name, help, labels=[]):
+        metric = Counter(name, help, labels)
+        self.__metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=[], buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.__metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Returns:
+            str: all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self.__metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
@@ -15,8 +15,18 @@
 
 import sys
 import os
+import ast
+import json
+import time
+import hashlib
+import tempfile
 import subprocess
+import collections
+import concurrent.futures
+import importlib.util
+import importlib.machinery
 import vyos.version
+import vyos.configtree
 import vyos.defaults
 import vyos.systemversions as systemversions
 import vyos.formatversions as formatversions
@@ -24,33 +34,231 @@ import vyos.formatversions as formatversions
 class MigratorError(Exception):
     pass
 
+def is_inprocess_script(migrate_script):
+    """
+    Check if a migration script is a Python script that defines a top-level
+    ``migrate(config)`` function, without running it.
+    """
+    try:
+        with open(migrate_script, 'r') as f:
+            source = f.read()
+        tree = ast.parse(source, filename=migrate_script)
+    except (OSError, UnicodeDecodeError, SyntaxError, ValueError):
+        return False
+
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == 'migrate':
+            return True
+    return False
+
+def load_migrate_function(migrate_script):
+    """
+    Load a migration script as a module and return its ``migrate`` function.
+    """
+    name = 'vyos_migration_' + '_'.join(migrate_script.split(os.sep)[-2:]).replace('-', '_')
+    loader = importlib.machinery.SourceFileLoader(name, migrate_script)
+    spec = importlib.util.spec_from_loader(name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module.migrate
+
+def get_declared_paths(migrate_script):
+    """
+    Get the config paths a migration script declares in a top-level
+    ``config_paths`` list, without running it. A script must not
+    read or change the config outside of these paths.
+
+    Returns:
+        list: paths, each a list of node names, or None if the script
+        doesn't declare them
+    """
+    try:
+        with open(migrate_script, 'r') as f:
+            source = f.read()
+        tree = ast.parse(source, filename=migrate_script)
+    except (OSError, UnicodeDecodeError, SyntaxError, ValueError):
+        return None
+
+    for node in tree.body:
+        if not isinstance(node, ast.Assign):
+            continue
+        if not any(isinstance(t, ast.Name) and t.id == 'config_paths' for t in node.targets):
+            continue
+        try:
+            paths = ast.literal_eval(node.value)
+        except ValueError:
+            return None
+        if not isinstance(paths, list) or not paths:
+            return None
+        for path in paths:
+            if not isinstance(path, list) or not path or \
+               not all(isinstance(n, str) for n in path):
+                return None
+        return paths
+    return None
+
+def get_chain_paths(migrate_scripts):
+    """
+    Get the config paths of a component's migration scripts, or None
+    if some of them run as executables or don't declare their paths.
+    """
+    paths = []
+    for migrate_script in migrate_scripts:
+        if not is_inprocess_script(migrate_script):
+            return None
+        script_paths = get_declared_paths(migrate_script)
+        if script_paths is None:
+            return None
+        paths += [p for p in script_paths if p not in paths]
+    return paths
+
+def paths_overlap(path_a, path_b):
+    n = min(len(path_a), len(path_b))
+    return path_a[:n] == path_b[:n]
+
+def group_chains(chains):
+    """
+    Split components into groups that can be migrated independently.
+    Components whose paths overlap, directly or through other components,
+    end up in the same group, in their original order.
+
+    Args:
+        chains (list): (component, scripts, paths) tuples
+
+    Returns:
+        list: lists of chains, ordered by their first component
+    """
+    parent = list(range(len(chains)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(chains)):
+        for j in range(i):
+            if any(paths_overlap(a, b) for a in chains[i][2] for b in chains[j][2]):
+                parent[find(i)] = find(j)
+
+    groups = collections.OrderedDict()
+    for i, chain in enumerate(chains):
+        groups.setdefault(find(i), []).append(chain)
+    return list(groups.values())
+
+def subtree_changes(old_tree, new_tree, path):
+    """
+    Get the changes between two config trees under a path, as operations
+    that ``apply_changes`` can repeat on another tree.
+    """
+    changes = []
+    for entry in vyos.configtree.diff_trees(old_tree, new_tree, path):
+        if entry.kind != vyos.configtree.DIFF_ADDED:
+            changes.append(('delete', entry.path))
+        if entry.kind != vyos.configtree.DIFF_REMOVED:
+            changes += _node_changes(new_tree, entry.path)
+            # Parent nodes may have been created as well
+            for i in range(1, len(entry.path)):
+                if new_tree.is_tag(entry.path[:i]):
+                    changes.append(('tag', entry.path[:i]))
+    return changes
+
+def _node_changes(tree, path):
+    changes = []
+    children = tree.list_nodes(path)
+    if children:
+        for name in children:
+            changes += _node_changes(tree, path + [name])
+    else:
+        values = tree.return_values(path)
+        if not values:
+            changes.append(('set', path, None, True))
+        for i, value in enumerate(values):
+            changes.append(('set', path, value, i == 0))
+    if tree.is_tag(path):
+        changes.append(('tag', path))
+    return changes
+
+def apply_changes(config_tree, changes):
+    for change in changes:
+        if change[0] == 'delete':
+            config_tree.delete(change[1])
+        elif change[0] == 'set':
+            config_tree.set(change[1], value=change[2], replace=change[3])
+        elif change[0] == 'tag':
+            config_tree.set_tag(change[1])
+
+def run_chain_group(config_string, migrate_scripts, paths):
+    """
+    Run migration scripts on a private copy of the config, in a worker
+    process, and return the changes they made in their paths,
+    and how long each script took.
+    """
+    old_tree = vyos.configtree.ConfigTree(config_string)
+    new_tree = vyos.configtree.ConfigTree(config_string)
+
+    timings = {}
+    for migrate_script in migrate_scripts:
+        start = time.monotonic()
+        try:
+            migrate = load_migrate_function(migrate_script)
+            migrate(new_tree)
+        except Exception as err:
+            raise MigratorError("Migration script {} failed: {}.".format(migrate_script, err))
+        timings[get_script_name(migrate_script)] = time.monotonic() - start
+
+    # Nested paths are covered by their parents
+    top_paths = []
+    for path in sorted(paths, key=len):
+        if not any(paths_overlap(path, p) for p in top_paths):
+            top_paths.append(path)
+
+    changes = []
+    for path in top_paths:
+        changes += subtree_changes(old_tree, new_tree, path)
+    return changes, timings
+
+def get_script_name(migrate_script):
+    """
+    Get the name of a migration script without its directory,
+    like ``ntp/0-to-1``.
+    """
+    return '/'.join(migrate_script.split(os.sep)[-2:])
+
+# Number of migration results to keep in the cache
+CACHE_SIZE = 16
+
+# Worker processes cost their startup, and every one of them parses and
+# serializes the whole config, which takes longer than most scripts.
+# Groups are only run in parallel if that saves at least this many seconds,
+# going by how long their scripts took when they last ran.
+PARALLEL_MIN_TIME = 1.0
+
 class Migrator(object):
-    def __init__(self, config_file, force=False, set_vintage=None):
+    def __init__(self, config_file, force=False, set_vintage=None, cache_dir=None):
+        """
+        If ``cache_dir`` is set, migration results are kept there, keyed by
+        the hash of the config file and the scripts that ran on it, and
+        reused when the same file is migrated again. Script timings are
+        also kept there, for ``plan``.
+        """
         self._config_file = config_file
         self._force = force
         self._set_vintage = set_vintage
+        self._cache_dir = cache_dir
         self._config_file_vintage = None
         self._changed = False
+        self._timings = {}
 
     def read_config_file_versions(self):
         """
         Get component versions from config file footer and set vintage;
         return empty dictionary if config string is missing.
         """
-        cfg_file = self._config_file
-        component_versions = {}
-
-        cfg_versions = formatversions.read_vyatta_versions(cfg_file)
-
-        if cfg_versions:
-            self._config_file_vintage = 'vyatta'
-            component_versions = cfg_versions
+        vintage, component_versions = formatversions.read_versions_footer(self._config_file)
 
-        cfg_versions = formatversions.read_vyos_versions(cfg_file)
-
-        if cfg_versions:
-            self._config_file_vintage = 'vyos'
-            component_versions = cfg_versions
+        if vintage:
+            self._config_file_vintage = vintage
 
         return component_versions
 
@@ -75,6 +283,60 @@ class Migrator(object):
         """
         Run migration scripts iteratively, until config file version equals
         system component version.
+
+        Scripts that define a ``migrate(config)`` function are run in this
+        process: the function gets a ``vyos.configtree.ConfigTree`` shared by all such
+        scripts and modifies it in place, and the config file is written only once,
+        at the end. Other scripts are run as executables that take the config file
+        name as an argument; the shared tree is written out before them, and parsed
+        again when it's needed next.
+
+        If every script of a component runs in-process and declares
+        the config paths it works with in ``config_paths``, the component
+        can be migrated in parallel with other such components, unless their
+        paths overlap. Scripts of a component always run in order, and
+        components that can't run in parallel are run in sorted order,
+        after all components before them.
+        """
+        steps, rev_versions = self.get_migration_steps(config_file_versions,
+                                                       system_versions)
+
+        # Config tree shared by in-process scripts, and whether it has changes
+        # that are not in the file yet
+        self._config_tree = None
+        self._config_dirty = False
+
+        # Components with declared paths that wait to be run together
+        pending = []
+
+        for key, scripts in steps:
+            paths = get_chain_paths(scripts)
+            if paths is not None:
+                pending.append((key, scripts, paths))
+                continue
+
+            self.run_chains(pending)
+            pending = []
+
+            for migrate_script in scripts:
+                self.run_migration_script(migrate_script)
+
+        self.run_chains(pending)
+
+        if self._config_dirty:
+            self.write_config_tree(self._config_tree)
+
+        return rev_versions
+
+    def get_migration_steps(self, config_file_versions, system_versions):
+        """
+        Find migration scripts to run, until config file version equals
+        system component version.
+
+        Returns:
+            tuple: a list of (component, scripts) tuples with the components
+            that have scripts to run, in the order they are run, and
+            a dictionary of component versions after migration
         """
         cfg_versions = config_file_versions
         sys_versions = system_versions
@@ -82,6 +344,7 @@ class Migrator(object):
         sys_keys = list(sys_versions.keys())
         sys_keys.sort()
 
+        steps = []
         rev_versions = {}
 
         for key in sys_keys:
@@ -94,55 +357,292 @@ class Migrator(object):
             migrate_script_dir = os.path.join(
                     vyos.defaults.directories['migrate'], key)
 
+            scripts = []
             while cfg_ver < sys_ver:
                 next_ver = cfg_ver + 1
 
                 migrate_script = os.path.join(migrate_script_dir,
                         '{}-to-{}'.format(cfg_ver, next_ver))
 
-                try:
-                    subprocess.check_output([migrate_script,
-                        self._config_file])
-                except FileNotFoundError:
-                    pass
-                except subprocess.CalledProcessError as err:
-                    print("Called process error: {}.".format(err))
-                    sys.exit(1)
+                if os.path.exists(migrate_script):
+                    scripts.append(migrate_script)
 
                 cfg_ver = next_ver
 
             rev_versions[key] = cfg_ver
+            if scripts:
+                steps.append((key, scripts))
 
-        return rev_versions
+        return steps, rev_versions
+
+    def get_config_tree(self):
+        if self._config_tree is None:
+            try:
+                self._config_tree = vyos.configtree.ConfigTree.from_file(self._config_file)
+            except Exception as err:
+                print("Failed to load the config: {}.".format(err))
+                sys.exit(1)
+        return self._config_tree
+
+    def run_migration_script(self, migrate_script):
+        """
+        Run one migration script, in this process if it can be.
+        """
+        start = time.monotonic()
+        self.__run_migration_script(migrate_script)
+        self._timings[get_script_name(migrate_script)] = time.monotonic() - start
+
+    def __run_migration_script(self, migrate_script):
+        if is_inprocess_script(migrate_script):
+            config_tree = self.get_config_tree()
+            try:
+                migrate = load_migrate_function(migrate_script)
+                self._config_dirty = True
+                migrate(config_tree)
+            except Exception as err:
+                print("Migration script {} failed: {}.".format(migrate_script, err))
+                sys.exit(1)
+            return
+
+        if self._config_dirty:
+            self.write_config_tree(self._config_tree)
+            self._config_dirty = False
+        # The script changes the file, the tree is no longer up to date
+        self._config_tree = None
+
+        try:
+            subprocess.check_output([migrate_script,
+                self._config_file])
+        except FileNotFoundError:
+            pass
+        except subprocess.CalledProcessError as err:
+            print("Called process error: {}.".format(err))
+            sys.exit(1)
+
+    def run_chains(self, chains):
+        """
+        Run migration scripts of components with declared config paths,
+        groups of components with independent paths in parallel if their
+        scripts are known to take long enough for that to pay off.
+        """
+        groups = group_chains(chains)
+
+        if len(groups) < 2 or (os.cpu_count() or 1) < 2 or \
+           self.get_parallel_saving(groups) < PARALLEL_MIN_TIME:
+            for key, scripts, paths in chains:
+                for migrate_script in scripts:
+                    self.run_migration_script(migrate_script)
+            return
+
+        # Every worker parses its own copy of the config and sends back
+        # the changes in its paths, which are then applied to the shared tree
+        config_tree = self.get_config_tree()
+        config_string = config_tree.to_string()
+
+        workers = min(len(groups), os.cpu_count())
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for group in groups:
+                scripts = [s for key, ss, paths in group for s in ss]
+                paths = [p for key, ss, ps in group for p in ps]
+                futures.append(executor.submit(run_chain_group, config_string, scripts, paths))
+
+            try:
+                results = [f.result() for f in futures]
+            except MigratorError as err:
+                print(err)
+                sys.exit(1)
+            except Exception as err:
+                print("Parallel migration failed: {}.".format(err))
+                sys.exit(1)
+
+        for changes, timings in results:
+            if changes:
+                apply_changes(config_tree, changes)
+                self._config_dirty = True
+            self._timings.update(timings)
+
+    def get_parallel_saving(self, groups):
+        """
+        Estimate how many seconds running the groups in parallel would save,
+        from the recorded script times. Scripts that never ran count as instant.
+        """
+        timings = self.load_timings()
+        timings.update(self._timings)
+
+        group_times = sorted(sum(timings.get(get_script_name(s), 0) for key, scripts, paths in group
+                                 for s in scripts)
+                             for group in groups)
+        return sum(group_times[:-1])
+
+    def write_config_tree(self, config_tree):
+        try:
+            with open(self._config_file, 'w') as f:
+                f.write(config_tree.to_string())
+        except OSError as err:
+            print("Failed to save the modified config: {}".format(err))
+            sys.exit(1)
 
     def write_config_file_versions(self, cfg_versions):
         """
-        Write new versions string.
+        Replace versions string.
         """
         versions_string = formatversions.format_versions_string(cfg_versions)
 
         os_version_string = vyos.version.get_version()
 
-        if self._config_file_vintage == 'vyatta':
-            formatversions.write_vyatta_versions_foot(self._config_file,
-                                                      versions_string,
-                                                      os_version_string)
+        formatversions.write_versions_footer(self._config_file,
+                                             self._config_file_vintage,
+                                             versions_string,
+                                             os_version_string)
+
+    def get_cache_key(self, steps, sys_versions):
+        """
+        Hash everything the migration result depends on: the config file,
+        the scripts to run, and the options.
+        """
+        key = hashlib.sha256()
+
+        with open(self._config_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                key.update(chunk)
+
+        params = [sorted(sys_versions.items()), self._force, self._set_vintage,
+                  vyos.version.get_version()]
+        key.update(json.dumps(params).encode())
+
+        for component, scripts in steps:
+            for migrate_script in scripts:
+                key.update(get_script_name(migrate_script).encode())
+                with open(migrate_script, 'rb') as f:
+                    key.update(hashlib.sha256(f.read()).digest())
 
-        if self._config_file_vintage == 'vyos':
-            formatversions.write_vyos_versions_foot(self._config_file,
-                                                    versions_string,
-                                                    os_version_string)
+        return key.hexdigest()
+
+    def get_cache_file(self, cache_key):
+        return os.path.join(self._cache_dir, '{}.boot'.format(cache_key))
+
+    def load_cached_config(self, cache_key):
+        """
+        Replace the config file with a cached migration result, if there is one.
+
+        Returns:
+            bool: True if the result was found
+        """
+        cache_file = self.get_cache_file(cache_key)
+        try:
+            with open(cache_file, 'rb') as f:
+                cached_config = f.read()
+            # Keep recently used results in the cache
+            os.utime(cache_file)
+        except OSError:
+            return False
+
+        with open(self._config_file, 'rb') as f:
+            if f.read() == cached_config:
+                return True
+
+        try:
+            with open(self._config_file, 'wb') as f:
+                f.write(cached_config)
+        except OSError as err:
+            print("Failed to save the migrated config: {}".format(err))
+            sys.exit(1)
+
+        self._changed = True
+        return True
+
+    def save_cached_config(self, cache_key):
+        """
+        Keep the migrated config file in the cache, and remove
+        the least recently used results if there are too many.
+        Failures are ignored, the cache is only an optimization.
+        """
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            with open(self._config_file, 'rb') as f:
+                config = f.read()
+            with tempfile.NamedTemporaryFile(dir=self._cache_dir, delete=False) as f:
+                f.write(config)
+            os.replace(f.name, self.get_cache_file(cache_key))
+
+            cache_files = [os.path.join(self._cache_dir, n)
+                           for n in os.listdir(self._cache_dir) if n.endswith('.boot')]
+            cache_files.sort(key=os.path.getmtime, reverse=True)
+            for cache_file in cache_files[CACHE_SIZE:]:
+                os.remove(cache_file)
+        except OSError:
+            pass
+
+    def get_timings_file(self):
+        return os.path.join(self._cache_dir, 'timings.json')
+
+    def load_timings(self):
+        """
+        Get how long each migration script took when it last ran.
+
+        Returns:
+            dict: times in seconds, keyed by script names like ``ntp/0-to-1``
+        """
+        if not self._cache_dir:
+            return {}
+        try:
+            with open(self.get_timings_file(), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_timings(self):
+        if not self._timings:
+            return
+        timings = self.load_timings()
+        timings.update(self._timings)
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=self._cache_dir, delete=False) as f:
+                json.dump(timings, f, indent=2, sort_keys=True)
+            os.replace(f.name, self.get_timings_file())
+        except OSError:
+            pass
+
+    def plan(self):
+        """
+        Find migration scripts that ``run`` would run, without running them.
+
+        Returns:
+            tuple: a list of (script name, runs in-process, last run time
+            in seconds or None) tuples, and True if the result is already
+            in the cache
+        """
+        cfg_versions = self.read_config_file_versions()
+        if self._force:
+            cfg_versions = {}
+
+        sys_versions = systemversions.get_system_versions()
+        steps, rev_versions = self.get_migration_steps(cfg_versions, sys_versions)
+
+        timings = self.load_timings()
+
+        scripts = []
+        for component, migrate_scripts in steps:
+            for migrate_script in migrate_scripts:
+                name = get_script_name(migrate_script)
+                scripts.append((name, is_inprocess_script(migrate_script), timings.get(name)))
+
+        cached = False
+        if self._cache_dir and steps:
+            cached = os.path.exists(self.get_cache_file(self.get_cache_key(steps, sys_versions)))
+
+        return scripts, cached
 
     def run(self):
         """
         Gather component versions from config file and system.
-        Run migration scripts.
+        Run migration scripts, or use the cached result if the same
+            config was migrated before.
         Update vintage ('vyatta' or 'vyos'), if needed.
-        If changed, remove old versions string from config file, and
-            write new versions string.
+        If changed, replace versions string in config file.
         """
-        cfg_file = self._config_file
-
         cfg_versions = self.read_config_file_versions()
         if self._force:
             # This will force calling all migration scripts:
@@ -150,20 +650,31 @@ class Migrator(object):
 
         sys_versions = systemversions.get_system_versions()
 
+        cache_key = None
+        if self._cache_dir:
+            steps, rev_versions = self.get_migration_steps(cfg_versions, sys_versions)
+            # Configs that need no scripts are not worth keeping
+            if steps:
+                cache_key = self.get_cache_key(steps, sys_versions)
+                if self.load_cached_config(cache_key):
+                    return
+
         rev_versions = self.run_migration_scripts(cfg_versions, sys_versions)
 
+        if self._cache_dir:
+            self.save_timings()
+
         if rev_versions != cfg_versions:
             self._changed = True
 
         if self.update_vintage():
             self._changed = True
 
-        if not self._changed:
-            return
-
-        formatversions.remove_versions(cfg_file)
+        if self._changed:
+            self.write_config_file_versions(rev_versions)
 
-        self.write_config_file_versions(rev_versions)
+        if cache_key:
+            self.save_cached_config(cache_key)
 
     def config_changed(self):
         return self._changed
@@ -172,9 +683,15 @@ class VirtualMigrator(Migrator):
     def __init__(self, config_file, vintage='vyos'):
         super().__init__(config_file, set_vintage = vintage)
 
-    def run(self):
-        cfg_file = self._config_file
+    def plan(self):
+        cfg_versions = self.read_config_file_versions()
+        if not cfg_versions:
+            raise MigratorError("Config file has no version information;"
+                                " virtual migration not possible.")
+
+        return [], False
 
+    def run(self):
         cfg_versions = self.read_config_file_versions()
         if not cfg_versions:
             raise MigratorError("Config file has no version information;"
@@ -186,7 +703,5 @@ class VirtualMigrator(Migrator):
         if not self._changed:
             return
 
-        formatversions.remove_versions(cfg_file)
-
         self.write_config_file_versions(cfg_versions)
 
@@ -0,0 +1,209 @@
+# Copyright 2019 VyOS maintainers and contributors <maintainers@vyos.io>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+In-process versions of the built-in value validators from the validators
+directory, so that values can be checked without starting a process
+for every value.
+
+Example:
+    validator = get_validator('/usr/libexec/vyos/validators/numeric --range 1-65535')
+    validator('22')     # True
+    validator('65536')  # False
+
+The IP address validators follow the ipaddrcheck options that the shell
+validators use: a "single" address has no prefix length, a "host" address
+has a prefix length and is not the network address, and a "net" is
+a network address with a prefix length.
+"""
+
+import os
+import re
+import shlex
+import ipaddress
+
+
+mac_address_re = re.compile(r'^([0-9A-Fa-f]{2}[:]){5}([0-9A-Fa-f]{2})$')
+prefix_length_re = re.compile(r'^\d{1,3}$')
+range_re = re.compile(r'(\d+)\s*\-\s*(\d+)')
+
+
+def _single(value, address_class):
+    if '/' in value or '%' in value:
+        return None
+    try:
+        return address_class(value)
+    except ValueError:
+        return None
+
+def _interface(value, interface_class):
+    address, sep, prefix_length = value.partition('/')
+    if not sep or not prefix_length_re.match(prefix_length) or '%' in address:
+        return None
+    try:
+        return interface_class(value)
+    except ValueError:
+        return None
+
+def _is_host(interface):
+    if interface is None:
+        return False
+    # Point-to-point and single address prefixes have no network address
+    if interface.network.prefixlen >= interface.max_prefixlen - 1:
+        return True
+    return interface.ip != interface.network.network_address
+
+def _is_net(interface):
+    return interface is not None and interface.ip == interface.network.network_address
+
+def is_ipv4_single(value):
+    return _single(value, ipaddress.IPv4Address) is not None
+
+def is_ipv6_single(value):
+    return _single(value, ipaddress.IPv6Address) is not None
+
+def is_ipv4_cidr(value):
+    return _interface(value, ipaddress.IPv4Interface) is not None
+
+def is_ipv6_cidr(value):
+    return _interface(value, ipaddress.IPv6Interface) is not None
+
+def is_ipv4_host(value):
+    return _is_host(_interface(value, ipaddress.IPv4Interface))
+
+def is_ipv6_host(value):
+    return _is_host(_interface(value, ipaddress.IPv6Interface))
+
+def is_ipv4_net(value):
+    return _is_net(_interface(value, ipaddress.IPv4Interface))
+
+def is_ipv6_net(value):
+    return _is_net(_interface(value, ipaddress.IPv6Interface))
+
+def is_any_single(value):
+    return is_ipv4_single(value) or is_ipv6_single(value)
+
+def is_any_cidr(value):
+    return is_ipv4_cidr(value) or is_ipv6_cidr(value)
+
+def is_any_host(value):
+    return is_ipv4_host(value) or is_ipv6_host(value)
+
+def is_any_net(value):
+    return is_ipv4_net(value) or is_ipv6_net(value)
+
+def is_mac_address(value):
+    return mac_address_re.match(value) is not None
+
+def numeric(arguments):
+    """
+    Make a numeric validator from the arguments of the numeric validator script.
+
+    Args:
+        arguments (list): options, like ``['--range', '1-65535']``
+
+    Returns:
+        function: validator, or None if the arguments are not supported
+    """
+    number_type = int
+    lower = None
+    upper = None
+    minimum = None
+
+    args = list(arguments)
+    while args:
+        arg = args.pop(0)
+        if arg in ['-f', '--float']:
+            number_type = float
+        elif arg in ['-r', '--range'] and args:
+            match = range_re.match(args.pop(0))
+            if not match:
+                return None
+            lower, upper = int(match.group(1)), int(match.group(2))
+        elif arg in ['-n', '--non-negative']:
+            minimum = 'non-negative'
+        elif arg in ['-p', '--positive']:
+            minimum = 'positive'
+        else:
+            return None
+
+    def validate(value):
+        try:
+            number = number_type(value)
+        except ValueError:
+            return False
+        if lower is not None:
+            return lower <= number <= upper
+        if minimum == 'non-negative':
+            return number >= 0
+        if minimum == 'positive':
+            return number > 0
+        return True
+
+    return validate
+
+
+# Validators that take no arguments, by script name
+simple_validators = {
+    'cidr': is_any_cidr,
+    'interface-address': is_any_host,
+    'ip-address': is_any_single,
+    'ip-host': is_any_host,
+    'ip-prefix': is_any_net,
+    'ipv4-address': is_ipv4_single,
+    'ipv4-host': is_ipv4_host,
+    'ipv4-prefix': is_ipv4_net,
+    'ipv6-address': is_ipv6_single,
+    'ipv6-host': is_ipv6_host,
+    'ipv6-prefix': is_ipv6_net,
+    'mac-address': is_mac_address
+}
+
+# Validators that take arguments, by script name
+validator_factories = {
+    'numeric': numeric
+}
+
+def get_validator(command, validators_dir=None):
+    """
+    Find the in-process version of a validator command.
+
+    Args:
+        command (str): validator script path and its arguments
+        validators_dir (str): directory of the validator scripts; if given,
+            only scripts from it are replaced
+
+    Returns:
+        function: function that takes a value and returns True if it's valid,
+        or None if the validator can only be run as a command
+    """
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        return None
+    if not words:
+        return None
+
+    path, arguments = words[0], words[1:]
+    if validators_dir is not None and \
+       os.path.normpath(os.path.dirname(path)) != os.path.normpath(validators_dir):
+        return None
+
+    name = os.path.basename(path)
+    if name in simple_validators:
+        return simple_validators[name] if not arguments else None
+    if name in validator_factories:
+        return validator_factories[name](arguments)
+    return None
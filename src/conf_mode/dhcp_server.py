@@ -255,7 +255,7 @@ default_config_data = {
 
 def get_config():
     dhcp = default_config_data
-    conf = Config()
+    conf = Config(snapshot=True)
     if not conf.exists('service dhcp-server'):
         return None
     else:
@@ -20,6 +20,7 @@ import sys
 import os
 import subprocess
 import json
+import hashlib
 
 import vyos.defaults
 from vyos.config import Config
@@ -32,6 +33,9 @@ default_config_data = {
     'port' : '8080',
     'strict' : 'false',
     'debug' : 'false',
+    'async_commit' : 'false',
+    'commit_window' : '0',
+    'snapshot_max_age' : '1000',
     'api_keys' : [ {"id": "testapp", "key": "qwerty"} ]
 }
 
@@ -56,6 +60,15 @@ def get_config():
     if conf.exists('debug'):
         http_api['debug'] = 'true'
 
+    if conf.exists('async-commit'):
+        http_api['async_commit'] = 'true'
+
+    if conf.exists('commit-window'):
+        http_api['commit_window'] = conf.return_value('commit-window')
+
+    if conf.exists('snapshot-max-age'):
+        http_api['snapshot_max_age'] = conf.return_value('snapshot-max-age')
+
     if conf.exists('port'):
         port = conf.return_value('port')
         http_api['port'] = port
@@ -64,7 +77,9 @@ def get_config():
         for name in conf.list_nodes('keys id'):
             if conf.exists('keys id {0} key'.format(name)):
                 key = conf.return_value('keys id {0} key'.format(name))
-                new_key = { 'id': name, 'key': key }
+                # The server only needs the key hashes
+                key_hash = hashlib.sha256(key.encode()).hexdigest()
+                new_key = { 'id': name, 'key_hash': key_hash }
                 http_api['api_keys'].append(new_key)
 
     return http_api
@@ -81,9 +96,30 @@ def generate(http_api):
 
     return None
 
-def apply(http_api):
+def read_config_file():
+    try:
+        with open(config_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def listener_changed(old_http_api, http_api):
+    if old_http_api is None:
+        return True
+    for k in ['listen_address', 'port']:
+        if old_http_api.get(k) != http_api[k]:
+            return True
+    return False
+
+def apply(http_api, old_http_api=None):
     if http_api is not None:
-        os.system('sudo systemctl restart vyos-http-api.service')
+        # The server reloads everything but the listen address and port on SIGHUP,
+        # no need to drop its connections and session for that
+        if (not listener_changed(old_http_api, http_api)) and \
+           (subprocess.call('systemctl --quiet is-active vyos-http-api.service', shell=True) == 0):
+            os.system('sudo systemctl reload vyos-http-api.service')
+        else:
+            os.system('sudo systemctl restart vyos-http-api.service')
         for dep in dependencies:
             cmd = '{0}/{1}'.format(vyos_conf_scripts_dir, dep)
             try:
@@ -97,8 +133,9 @@ if __name__ == '__main__':
     try:
         c = get_config()
         verify(c)
+        old_c = read_config_file()
         generate(c)
-        apply(c)
+        apply(c, old_c)
     except ConfigError as e:
         print(e)
         sys.exit(1)
@@ -62,6 +62,13 @@ server {
 {% endif %}
         }
 
+{% if api %}
+        # HTTP API metrics are for local monitoring only
+        location = /metrics {
+                deny all;
+        }
+{% endif %}
+
         error_page 501 502 503 =200 @50*_json;
 
         location @50*_json {
@@ -257,7 +257,7 @@ def rmfile(file):
 
 def get_config():
     snmp = default_config_data
-    conf = Config()
+    conf = Config(snapshot=True)
     if not conf.exists('service snmp'):
         return None
     else:
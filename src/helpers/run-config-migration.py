@@ -20,8 +20,31 @@ import sys
 import argparse
 import datetime
 import subprocess
+import vyos.defaults
 from vyos.migrator import Migrator, VirtualMigrator
 
+def dry_run(migration):
+    scripts, cached = migration.plan()
+
+    if not scripts:
+        print("No migration scripts to run.")
+        return
+
+    print("Migration scripts to run:")
+    total = 0
+    for name, inprocess, last_time in scripts:
+        if last_time is None:
+            time_string = "never run"
+        else:
+            time_string = "{:.3f}s".format(last_time)
+            total += last_time
+        print("  {:<40} {:<12} {}".format(name,
+              "in-process" if inprocess else "executable", time_string))
+    print("Total time of the last runs: {:.3f}s".format(total))
+
+    if cached:
+        print("The result of this migration is cached and will be reused.")
+
 def main():
     argparser = argparse.ArgumentParser(
             formatter_class=argparse.RawTextHelpFormatter)
@@ -41,17 +64,35 @@ def main():
             help="Update the format of the trailing comments in"
                  " config file,\nfrom 'vyatta' to 'vyos'; no migration"
                  " scripts are run.")
+    argparser.add_argument('--dry-run', action='store_true',
+            help="Show the migration scripts that would run, and how long"
+                 " they took\nwhen they last ran; the config file is not"
+                 " changed.")
+    argparser.add_argument('--no-cache', action='store_true',
+            help="Always run migration scripts, instead of reusing the"
+                 " result\nof an earlier migration of the same config.")
     args = argparser.parse_args()
 
     config_file_name = args.config_file
     force_on = args.force
     vintage = args.set_vintage
     virtual = args.virtual
+    cache_dir = None if args.no_cache else vyos.defaults.directories['migrate_cache']
 
     if not os.access(config_file_name, os.R_OK):
         print("Read error: {}.".format(config_file_name))
         sys.exit(1)
 
+    if not virtual:
+        migration = Migrator(config_file_name, force=force_on,
+                             set_vintage=vintage, cache_dir=cache_dir)
+    else:
+        migration = VirtualMigrator(config_file_name)
+
+    if args.dry_run:
+        dry_run(migration)
+        sys.exit(0)
+
     if not os.access(config_file_name, os.W_OK):
         print("Write error: {}.".format(config_file_name))
         sys.exit(1)
@@ -68,12 +109,6 @@ def main():
         print("Called process error: {}.".format(err))
         sys.exit(1)
 
-    if not virtual:
-        migration = Migrator(config_file_name, force=force_on,
-                             set_vintage=vintage)
-    else:
-        migration = VirtualMigrator(config_file_name)
-
     migration.run()
 
     if not migration._changed:
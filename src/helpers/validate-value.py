@@ -3,41 +3,73 @@
 import re
 import os
 import sys
+import shlex
 import argparse
 
+import vyos.defaults
+import vyos.validators
+
 parser = argparse.ArgumentParser()
-parser.add_argument('--regex', action='append')
-parser.add_argument('--exec', action='append')
-parser.add_argument('--value', action='store')
+parser.add_argument('--regex', action='append', default=[])
+parser.add_argument('--exec', action='append', default=[])
+parser.add_argument('--value', action='append', nargs='+', default=[],
+                    help="Values to check, all of them must be valid")
 
 args = parser.parse_args()
 
+values = [v for vs in args.value for v in vs]
+
 debug = False
 
-# Multiple arguments work like logical OR
+validators_dir = os.environ.get('vyos_validators_dir', vyos.defaults.directories['validators'])
 
-try:
-    for r in args.regex:
-        if re.fullmatch(r, args.value):
-            sys.exit(0)
-except Exception as exn:
-    if debug:
-        print(exn)
-    else:
-        pass
-
-try:
-    for cmd in args.exec:
-        cmd = "{0} {1}".format(cmd, args.value)
+regexes = []
+for r in args.regex:
+    try:
+        regexes.append(re.compile(r))
+    except Exception as exn:
         if debug:
-            print(cmd)
-        res = os.system(cmd)
-        if res == 0:
-            sys.exit(0)
-except Exception as exn:
+            print(exn)
+
+def run_command(cmd, value):
+    cmd = "{0} {1}".format(cmd, shlex.quote(value))
     if debug:
-        print(exn)
-    else:
-        pass
+        print(cmd)
+    return os.system(cmd) == 0
+
+# Built-in validators are run in this process, others as commands
+validators = []
+for cmd in args.exec:
+    validator = vyos.validators.get_validator(cmd, validators_dir)
+    if validator is None:
+        validator = lambda value, cmd=cmd: run_command(cmd, value)
+    validators.append(validator)
+
+# Multiple arguments work like logical OR
+def is_valid(value):
+    for r in regexes:
+        if r.fullmatch(value):
+            return True
+
+    for validator in validators:
+        try:
+            if validator(value):
+                return True
+        except Exception as exn:
+            if debug:
+                print(exn)
+
+    return False
+
+if not values:
+    sys.exit(1)
+
+invalid = [v for v in values if not is_valid(v)]
+
+if invalid:
+    if len(values) > 1:
+        for value in invalid:
+            print("Invalid value: {0}".format(value), file=sys.stderr)
+    sys.exit(1)
 
-sys.exit(1)
+sys.exit(0)
@@ -63,11 +63,8 @@ with tempfile.NamedTemporaryFile() as file_to_migrate:
 
     migration = vyos.migrator.Migrator(file_to_migrate.name)
     migration.run()
-    if migration.config_changed():
-        with open(file_to_migrate.name, 'r') as fd:
-            config_file = fd.read()
 
-merge_config_tree = ConfigTree(config_file)
+    merge_config_tree = ConfigTree.from_file(file_to_migrate.name)
 
 effective_config = Config()
 
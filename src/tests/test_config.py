@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019 VyOS maintainers and contributors
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or later as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import os
+import tempfile
+import unittest
+from unittest import TestCase, mock
+
+from vyos.config import Config, VyOSError
+
+
+# Templates for the nodes of tests/data/config.valid
+templates = {
+    'top-level-leaf-node': 'type: txt\n',
+    'top-level-valueless-node': 'help: Valueless node\n',
+    'top-level-tag-node': 'tag:\ntype: txt\n',
+    'top-level-tag-node/node.tag/top-level-tag-node-child': 'type: txt\n',
+    'normal-node': '',
+    'normal-node/normal-node-child': '',
+    'normal-node/normal-node-child/multi-node': 'multi:\ntype: txt\n',
+    'normal-node/normal-node-child/tag-node': 'tag:\ntype: txt\n',
+    'normal-node/normal-node-child/tag-node/node.tag/some-option': 'type: txt\n',
+}
+
+
+class TestConfigSnapshot(TestCase):
+    def setUp(self):
+        with open('tests/data/config.valid', 'r') as f:
+            self.config_string = f.read()
+
+        self.commands = []
+
+        def run(cmd):
+            self.commands.append(cmd)
+            op = cmd[-1] if cmd[-1] == 'showConfig' else cmd[1]
+            path = " ".join(cmd[2:])
+            if op == 'showConfig':
+                return self.config_string
+            elif op == 'isMulti' and path.endswith('multi-node'):
+                return ''
+            elif op == 'isLeaf' and not path.endswith('tag-node'):
+                return ''
+            elif op == 'isTag' and path.endswith('tag-node'):
+                return ''
+            raise VyOSError()
+
+        patcher = mock.patch.object(Config, '_run', side_effect=run)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.templates_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.templates_dir.cleanup)
+        for path, node_def in templates.items():
+            os.makedirs(os.path.join(self.templates_dir.name, path))
+            with open(os.path.join(self.templates_dir.name, path, 'node.def'), 'w') as f:
+                f.write(node_def)
+
+        patcher = mock.patch.dict('vyos.defaults.directories', {'templates': self.templates_dir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.config = Config(snapshot=True)
+        self.commands = []
+
+    def test_snapshot_loaded(self):
+        self.assertTrue(self.config.has_snapshot())
+
+    def test_exists(self):
+        self.assertTrue(self.config.exists('top-level-valueless-node'))
+        self.assertTrue(self.config.exists('top-level-leaf-node foo'))
+        self.assertFalse(self.config.exists('top-level-leaf-node bar'))
+        self.assertFalse(self.config.exists('no-such-node'))
+        self.assertTrue(self.config.exists_effective('normal-node normal-node-child'))
+        self.assertEqual(self.commands, [])
+
+    def test_return_value(self):
+        self.config.set_level('top-level-tag-node')
+        self.assertEqual(self.config.list_nodes(''), ['foo', 'bar'])
+        self.assertEqual(self.config.return_value('foo top-level-tag-node-child'), 'some-value')
+        self.assertEqual(self.config.return_value('bar top-level-tag-node-child'), 'another-value')
+        self.assertEqual(self.config.return_value('baz top-level-tag-node-child', default='none'), 'none')
+        self.assertEqual(self.commands, [])
+
+    def test_config_dict(self):
+        self.config.set_level('top-level-tag-node')
+        self.assertEqual(self.config.get_config_dict('foo'), {'top-level-tag-node-child': 'some-value'})
+        self.assertEqual(self.config.get_config_dict('baz', default={}), {})
+        self.assertEqual(self.commands, [])
+
+    def test_utf8(self):
+        self.config_string = self.config_string.replace('top-level-leaf-node foo', 'top-level-leaf-node "Zürich"')
+        config = Config(snapshot=True)
+        self.assertTrue(config.has_snapshot())
+        self.assertEqual(config.return_value('top-level-leaf-node'), 'Zürich')
+
+    def test_templates(self):
+        self.assertTrue(self.config.is_tag('top-level-tag-node'))
+        self.assertFalse(self.config.is_tag('top-level-tag-node foo'))
+        self.assertTrue(self.config.is_leaf('top-level-tag-node foo top-level-tag-node-child'))
+        self.assertTrue(self.config.is_leaf('top-level-leaf-node'))
+        self.assertFalse(self.config.is_leaf('top-level-leaf-node foo'))
+        self.assertFalse(self.config.is_leaf('top-level-valueless-node'))
+        self.assertTrue(self.config.is_multi('normal-node normal-node-child multi-node'))
+        self.assertTrue(self.config.is_tag('normal-node normal-node-child tag-node'))
+        self.assertTrue(self.config.is_leaf('normal-node normal-node-child tag-node bar some-option'))
+        self.assertFalse(self.config.is_leaf('normal-node no-such-node'))
+        self.assertFalse(self.config.is_leaf('top-level-leaf-node foo bar'))
+        self.assertEqual(self.commands, [])
+
+    def test_query_many(self):
+        config = Config()
+        self.commands = []
+        queries = [('return_value', 'top-level-tag-node {0} top-level-tag-node-child'.format(n))
+                   for n in ['foo', 'bar', 'baz']]
+        queries.append(('list_nodes', 'top-level-tag-node'))
+        self.assertEqual(config.query_many(queries), ['some-value', 'another-value', None, ['foo', 'bar']])
+        # inSession and showConfig for the snapshot, nothing per query
+        self.assertEqual([c[-1] if c[-1] == 'showConfig' else c[1] for c in self.commands],
+                         ['showConfig', 'inSession'])
+
+    def test_no_templates(self):
+        with mock.patch.dict('vyos.defaults.directories', {'templates': '/nonexistent'}):
+            config = Config(snapshot=True)
+        self.commands = []
+        self.assertTrue(config.is_tag('top-level-tag-node'))
+        self.assertEqual(len(self.commands), 1)
+
+    def test_reload_clears_cache(self):
+        config = Config(snapshot=True, cache_size=10)
+        self.assertEqual(config.return_value('top-level-leaf-node'), 'foo')
+        self.config_string = self.config_string.replace('top-level-leaf-node foo', 'top-level-leaf-node bar')
+        config.load_snapshot()
+        self.assertEqual(config.return_value('top-level-leaf-node'), 'bar')
+
+    def test_fallback(self):
+        with mock.patch.object(Config, '_make_tree', side_effect=OSError()):
+            config = Config(snapshot=True)
+        self.assertFalse(config.has_snapshot())
+        self.assertFalse(config.exists('top-level-valueless-node'))
+
+
+class TestConfigCache(TestCase):
+    def setUp(self):
+        self.commands = []
+
+        def run(cmd):
+            self.commands.append(cmd)
+            if cmd[1] == 'exists' and cmd[2:] == ['service', 'snmp', 'v3']:
+                return ''
+            raise VyOSError()
+
+        patcher = mock.patch.object(Config, '_run', side_effect=run)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.config = Config(cache_size=2)
+
+    def test_hits(self):
+        for i in range(0, 3):
+            self.assertTrue(self.config.exists('service snmp v3'))
+        self.assertEqual(len(self.commands), 1)
+        self.assertEqual(self.config.cache_stats(), {'hits': 2, 'misses': 1, 'size': 1})
+
+    def test_absolute_path(self):
+        self.config.exists('service snmp v3')
+        self.config.set_level('service snmp')
+        self.assertTrue(self.config.exists('v3'))
+        self.assertEqual(len(self.commands), 1)
+
+    def test_eviction(self):
+        self.config.exists('service snmp v3')
+        self.config.exists('service snmp v1')
+        self.config.exists('service snmp v2')
+        self.assertEqual(self.config.cache_stats()['size'], 2)
+        self.config.exists('service snmp v3')
+        self.assertEqual(len(self.commands), 4)
+
+    def test_bound_session(self):
+        session = mock.Mock()
+        self.config.bind_session(session)
+        on_change = session.add_change_callback.call_args[0][0]
+
+        self.config.exists('service snmp v3')
+        on_change()
+        self.config.exists('service snmp v3')
+        self.assertEqual(len(self.commands), 2)
+
+    def test_session_changed(self):
+        self.config.session_changed()
+        self.config.exists('service snmp v3')
+        # Still unchanged, cache is kept
+        self.config.session_changed()
+        self.config.exists('service snmp v3')
+        self.assertEqual(self.config.cache_stats()['hits'], 1)
+
+    def test_disabled(self):
+        config = Config()
+        config.exists('service snmp v3')
+        config.exists('service snmp v3')
+        self.assertEqual(config.cache_stats(), {'hits': 0, 'misses': 0, 'size': 0})
+
+
+class TestRun(TestCase):
+    def test_utf8(self):
+        self.assertEqual(Config()._run(['/bin/echo', 'description', 'Zürich']), "description Zürich\n")
+
+
+class TestIterConfig(TestCase):
+    def test_raw(self):
+        config = Config()
+        config._cli_shell_api = '/bin/echo'
+        config.set_level('system')
+        self.assertEqual("".join(config.iter_config('ntp', format='raw')), "showConfig system ntp\n")
+
+    def test_subtree(self):
+        config = Config()
+        with mock.patch.object(Config, '_run', return_value='') as run, \
+             mock.patch.object(Config, '_make_tree') as make_tree:
+            make_tree.return_value.iter_commands.return_value = iter(["set server 'pool.ntp.org'\n"])
+            commands = "".join(config.iter_config('system ntp', format='commands'))
+        self.assertEqual(commands, "set system ntp server 'pool.ntp.org'\n")
+        # Only the subtree is shown
+        self.assertEqual(run.call_args[0][0][-3:], ['showConfig', 'system', 'ntp'])
+
+    def test_invalid_format(self):
+        with self.assertRaises(VyOSError):
+            list(Config().iter_config('system', format='xml'))
+
+
+class TestSubtreeChanged(TestCase):
+    def test_changed(self):
+        configs = {
+            '--show-active-only': {'system ntp': 'server foo\n', 'service ssh': 'port 22\n'},
+            '--show-working-only': {'system ntp': 'server bar\n', 'service ssh': 'port 22\n',
+                                    'system syslog': 'global\n'},
+        }
+
+        def run(cmd):
+            try:
+                return configs[cmd[3]][" ".join(cmd[5:])]
+            except KeyError:
+                raise VyOSError()
+
+        with mock.patch.object(Config, '_run', side_effect=run):
+            config = Config()
+            self.assertTrue(config.subtree_changed('system ntp'))
+            self.assertFalse(config.subtree_changed('service ssh'))
+            self.assertTrue(config.subtree_changed('system syslog'))
+            self.assertFalse(config.subtree_changed('service snmp'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -17,6 +17,7 @@
 #
 
 import os
+import json
 import tempfile
 import unittest
 from unittest import TestCase, mock
@@ -59,3 +60,135 @@ class TestConfigParser(TestCase):
     def test_rename_duplicate(self):
         with self.assertRaises(vyos.configtree.ConfigTreeError):
             self.config.rename(["top-level-tag-node", "foo"], "bar")
+
+    def test_to_dict(self):
+        self.assertEqual(self.config.to_dict(["top-level-tag-node"]),
+            {"foo": {"top-level-tag-node-child": "some-value"},
+             "bar": {"top-level-tag-node-child": "another-value"}})
+        self.assertEqual(self.config.to_dict()["top-level-leaf-node"], "foo")
+        self.assertEqual(self.config.to_dict()["top-level-valueless-node"], {})
+
+    def test_from_file(self):
+        config = vyos.configtree.ConfigTree.from_file('tests/data/config.valid')
+        self.assertEqual(config.to_string(), self.config.to_string())
+
+    def test_to_json(self):
+        self.assertEqual(json.loads(self.config.to_json(["normal-node"]))["option-with-quoted-value"], "some-value")
+        with self.assertRaises(vyos.configtree.ConfigTreeError):
+            self.config.to_json(["no-such-node"])
+
+    def test_iter_json(self):
+        self.assertEqual("".join(self.config.iter_json()), json.dumps(self.config.to_dict()))
+        self.assertEqual(json.loads("".join(self.config.iter_json(["top-level-tag-node"]))),
+            self.config.to_dict(["top-level-tag-node"]))
+        with self.assertRaises(vyos.configtree.ConfigTreeError):
+            list(self.config.iter_json(["no-such-node"]))
+
+    def test_iter_commands(self):
+        commands = list(self.config.iter_commands(["top-level-tag-node"]))
+        self.assertEqual(commands,
+            ["set top-level-tag-node foo top-level-tag-node-child 'some-value'\n",
+             "set top-level-tag-node bar top-level-tag-node-child 'another-value'\n"])
+        self.assertIn("set top-level-valueless-node\n", list(self.config.iter_commands()))
+
+
+class TestQuoting(TestCase):
+    def test_command_value(self):
+        self.assertEqual(vyos.configtree.quote_command_value("foo"), "'foo'")
+        self.assertEqual(vyos.configtree.quote_command_value("it's"), "'it'\\''s'")
+
+
+class TestLibrary(TestCase):
+    def test_loaded_once(self):
+        with mock.patch('vyos.configtree.cdll') as cdll:
+            cdll.LoadLibrary.return_value.from_string.return_value = 1
+            vyos.configtree.ConfigTree("foo bar\n", libpath='/test/libvyosconfig.so')
+            vyos.configtree.ConfigTree("foo baz\n", libpath='/test/libvyosconfig.so')
+        cdll.LoadLibrary.assert_called_once_with('/test/libvyosconfig.so')
+
+    def test_no_subtree_export(self):
+        with mock.patch('vyos.configtree.cdll') as cdll:
+            lib = cdll.LoadLibrary.return_value
+            lib.from_string.return_value = 1
+            tree = vyos.configtree.ConfigTree("foo bar\n", libpath='/test/libvyosconfig-nosubtree.so')
+        # Libraries that export to_json but not get_subtree
+        vyos.configtree.get_library('/test/libvyosconfig-nosubtree.so').get_subtree = None
+        lib.exists.return_value = 1
+        lib.list_nodes.return_value = b'[]'
+        self.assertEqual(tree.to_json(['foo']), '{}')
+        self.assertEqual(tree.to_dict(['foo']), {})
+
+
+class TestStripComments(TestCase):
+    def test_trailing_comments(self):
+        self.assertEqual(vyos.configtree.strip_comments("foo {\n}\n/* bar */\n/* baz {} */\n"),
+                         ("foo {\n}", "/* bar */\n/* baz {} */\n"))
+
+    def test_asterisk_in_comment(self):
+        self.assertEqual(vyos.configtree.strip_comments("foo bar\n/* a * b **/\n"),
+                         ("foo bar", "/* a * b **/\n"))
+
+    def test_no_comments(self):
+        self.assertEqual(vyos.configtree.strip_comments("foo bar"), ("foo bar", ""))
+
+    def test_stray_slash(self):
+        with self.assertRaises(ValueError):
+            vyos.configtree.strip_comments("foo bar\n/\n")
+
+    def test_malformed_comment_end(self):
+        with self.assertRaises(ValueError):
+            vyos.configtree.strip_comments("foo bar */\n")
+
+
+class TestDiffTrees(TestCase):
+    def make_tree(self, data):
+        tree = mock.Mock()
+        tree.exists.return_value = True
+        tree.to_dict.return_value = data
+        return tree
+
+    def test_diff(self):
+        old = self.make_tree({
+            'system': {'host-name': 'vyos', 'name-server': ['192.0.2.1', '192.0.2.2'], 'ntp': {}},
+            'service': {'ssh': {'port': '22'}},
+        })
+        new = self.make_tree({
+            'system': {'host-name': 'vyos', 'name-server': '192.0.2.1', 'ntp': {'server': {'example.com': {}}}},
+            'interfaces': {'loopback': {'lo': {}}},
+        })
+        D = vyos.configtree.DiffEntry
+        self.assertEqual(list(vyos.configtree.diff_trees(old, new)), [
+            D('changed', ['system', 'name-server'], ['192.0.2.1', '192.0.2.2'], '192.0.2.1'),
+            D('added', ['system', 'ntp', 'server'], None, {'example.com': {}}),
+            D('removed', ['service'], {'ssh': {'port': '22'}}, None),
+            D('added', ['interfaces'], None, {'loopback': {'lo': {}}}),
+        ])
+
+    def test_identical(self):
+        tree = self.make_tree({'system': {'host-name': 'vyos'}})
+        self.assertEqual(list(vyos.configtree.diff_trees(tree, tree)), [])
+
+    def test_missing_path(self):
+        old = self.make_tree({})
+        old.exists.return_value = False
+        new = self.make_tree({'port': '22'})
+        self.assertEqual(list(vyos.configtree.diff_trees(old, new, ['service', 'ssh'])),
+                         [vyos.configtree.DiffEntry('added', ['service', 'ssh'], None, {'port': '22'})])
+
+
+class TestSplitBuffer(TestCase):
+    def test_split(self):
+        with open('tests/data/config.valid', 'r') as f:
+            config_string = f.read()
+        config_bytes = config_string.encode()
+
+        config_end, comments = vyos.configtree.split_buffer(config_bytes, len(config_bytes))
+        self.assertEqual((config_bytes[:config_end].decode(), comments),
+                         vyos.configtree.strip_comments(config_string))
+
+    def test_long_comments(self):
+        config_string = "foo {\n    bar baz\n}\n" + ("/* comment */\n" * 10000)
+        config_bytes = config_string.encode()
+
+        config_end, comments = vyos.configtree.split_buffer(config_bytes, len(config_bytes))
+        self.assertEqual(config_bytes[:config_end], b"foo {\n    bar baz\n}")
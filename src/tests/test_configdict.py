@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019 VyOS maintainers and contributors
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or later as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import unittest
+from unittest import TestCase, mock
+
+from vyos.configdict import compile_description, retrieve_config
+
+
+description = {
+    'host_name': (['host-name'], str),
+    'name_servers': (['name-server'], list),
+    'ntp': (['ntp'], bool),
+    'users': (['login', 'user'], dict, {
+        'level': (['level'], str),
+        'full_name': (['full-name'], str),
+    }),
+    'banner_pre': (['login', 'banner', 'pre-login'], str),
+    'syslog_host': (['syslog', 'host'], list),
+    'syslog_file': (['syslog', 'file'], list),
+}
+
+config_data = {
+    'system host-name': 'vyos',
+    'system name-server': ['192.0.2.1'],
+    'system ntp': True,
+    'system login': True,
+    'system login user': ['vyos', 'jrandomhacker'],
+    'system login user vyos level': 'admin',
+    'system login user jrandomhacker level': 'operator',
+    'system login user jrandomhacker full-name': 'J. Random Hacker',
+}
+
+
+class TestRetrievalPlan(TestCase):
+    def setUp(self):
+        self.queries = []
+
+        def query_many(queries):
+            self.queries.append(queries)
+            empty = {'exists': False, 'return_value': None, 'return_values': [], 'list_nodes': []}
+            return [config_data.get(q[1], empty[q[0]]) for q in queries]
+
+        self.config = mock.Mock()
+        self.config.get_snapshot.return_value = self.config
+        self.config.query_many.side_effect = query_many
+
+    def test_retrieve(self):
+        expected = {
+            'host_name': 'vyos',
+            'name_servers': ['192.0.2.1'],
+            'ntp': True,
+            'users': {
+                'vyos': {'level': 'admin', 'full_name': None},
+                'jrandomhacker': {'level': 'operator', 'full_name': 'J. Random Hacker'},
+            },
+            'banner_pre': None,
+            'syslog_host': [],
+            'syslog_file': [],
+        }
+        self.assertEqual(retrieve_config(description, ['system'], self.config), expected)
+
+    def test_batches(self):
+        compile_description(description).retrieve(['system'], self.config)
+        # Prefix check, fields, and all tag node children at once
+        self.assertEqual(len(self.queries), 3)
+        # Nothing is looked up under the missing "syslog" node
+        self.assertFalse([q for q in self.queries[1] if q[1].startswith('system syslog ')])
+        # Both users are retrieved in the same batch
+        self.assertEqual(len(self.queries[2]), 4)
+
+    def test_one_snapshot(self):
+        compile_description(description).retrieve(['system'], self.config)
+        self.assertEqual(self.config.get_snapshot.call_count, 1)
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            compile_description({'foo': ['foo']})
+        with self.assertRaises(ValueError):
+            compile_description({'foo': ('foo', str)})
+        with self.assertRaises(ValueError):
+            compile_description({'foo': (['foo'], 'str')})
+        with self.assertRaises(ValueError):
+            compile_description({'foo': (['foo'], dict)})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019 VyOS maintainers and contributors
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or later as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+import os
+import unittest
+from unittest import TestCase, mock
+
+import vyos.configsession
+from vyos.configsession import ConfigSession, ConfigSessionError, close_session, get_session, get_session_env, parse_session_env
+
+
+class TestSessionEnv(TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(vyos.configsession._session_envs, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parse(self):
+        env_str = "declare -x -r VYATTA_CHANGES_ONLY_DIR=/opt/vyatta/config/tmp/changes_only_42; " \
+                  "declare -x -r VYATTA_CONFIG_TMP='/opt/vyatta/config/tmp/new_config_42';export VYATTA_EDIT_LEVEL=/;"
+        self.assertEqual(parse_session_env(env_str), {
+            'VYATTA_CHANGES_ONLY_DIR': '/opt/vyatta/config/tmp/changes_only_42',
+            'VYATTA_CONFIG_TMP': '/opt/vyatta/config/tmp/new_config_42',
+            'VYATTA_EDIT_LEVEL': '/',
+        })
+
+    def test_cached(self):
+        with mock.patch('subprocess.check_output', return_value=b'export VYATTA_EDIT_LEVEL=/;') as check_output:
+            env = get_session_env(42)
+            self.assertIs(get_session_env('42'), env)
+        check_output.assert_called_once_with([vyos.configsession.CLI_SHELL_API, 'getSessionEnv', '42'])
+        self.assertEqual(env['VYATTA_EDIT_LEVEL'], '/')
+        self.assertEqual(env['vyos_libexec_dir'], '/usr/libexec/vyos')
+        self.assertNotIn('VYATTA_EDIT_LEVEL', os.environ)
+
+
+class SessionTestCase(TestCase):
+    def setUp(self):
+        # Stand-ins for my_set and my_delete that echo their arguments or fail
+        patches = [
+            mock.patch.object(vyos.configsession, 'CLI_SHELL_API', '/bin/true'),
+            mock.patch.object(vyos.configsession, 'SET', '/bin/echo'),
+            mock.patch.object(vyos.configsession, 'DELETE', '/bin/false'),
+            mock.patch.dict(vyos.configsession._session_envs, clear=True),
+            mock.patch.dict(vyos.configsession._sessions, clear=True),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.session = ConfigSession(1)
+        # Tear the session down while the stand-ins are still in place
+        self.addCleanup(setattr, self, 'session', None)
+
+
+class TestGetSession(SessionTestCase):
+    def test_get_session(self):
+        self.assertIs(get_session(2), get_session(2))
+        self.assertIsNot(get_session(2), get_session(3))
+
+    def test_close_session(self):
+        session = get_session(2)
+        with mock.patch('subprocess.check_output', return_value=b'') as check_output:
+            close_session(2)
+            close_session(2)
+            session.close()
+        check_output.assert_called_once_with([vyos.configsession.CLI_SHELL_API, 'teardownSession'],
+                                             env=session.get_session_env())
+        self.assertIsNot(get_session(2), session)
+
+
+class TestShowConfig(SessionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.commands = []
+
+        # The session has an uncommitted change, which bare showConfig marks
+        def show_config(cmd_list):
+            self.commands.append(cmd_list)
+            if '--show-working-only' in cmd_list:
+                return "system {\n    host-name vyos\n}\n"
+            return "system {\n+    host-name vyos\n}\n"
+
+        patcher = mock.patch.object(ConfigSession, '_ConfigSession__run_command', side_effect=show_config)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.tree = mock.Mock()
+        self.tree.exists.side_effect = lambda path: path[0] == 'system'
+        self.tree.to_dict.side_effect = lambda path: {'host-name': 'vyos'} if path else {'system': {'host-name': 'vyos'}}
+        patcher = mock.patch('vyos.configtree.ConfigTree', return_value=self.tree)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_json(self):
+        self.assertEqual(self.session.show_config(['system'], format='json'), {'host-name': 'vyos'})
+
+    def test_modified_session(self):
+        self.assertEqual(self.session.show_config(['system'], format='json'), {'host-name': 'vyos'})
+        vyos.configtree.ConfigTree.assert_called_once_with("system {\n    host-name vyos\n}\n")
+
+    def test_multiple_paths(self):
+        res = self.session.show_config([['system'], []], format='json')
+        self.assertEqual(res, [{'host-name': 'vyos'}, {'system': {'host-name': 'vyos'}}])
+        self.assertEqual(len(self.commands), 1)
+
+    def test_raw(self):
+        self.session.show_config([['system'], ['system', 'ntp']])
+        self.assertEqual(self.commands, [vyos.configsession.SHOW_CONFIG + ['system'],
+                                         vyos.configsession.SHOW_CONFIG + ['system', 'ntp']])
+
+    def test_errors(self):
+        with self.assertRaises(ConfigSessionError):
+            self.session.show_config(['service'], format='json')
+        with self.assertRaises(ConfigSessionError):
+            self.session.show_config(['system'], format='xml')
+
+
+if __name__ == '__main__':
+    unittest.main()
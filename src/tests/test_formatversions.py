@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019 VyOS maintainers and contributors
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or later as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+import os
+import tempfile
+import unittest
+from unittest import TestCase, mock
+
+import vyos.formatversions as formatversions
+
+
+config = """system {
+    host-name vyos
+}
+"""
+
+vyos_foot = """// Warning: Do not remove the following line.
+// vyos-config-version: "ntp@0:ssh@0"
+// Release version: 1.2.0
+"""
+
+vyatta_foot = """/* Warning: Do not remove the following line. */
+/* === vyatta-config-version: "ntp@0:ssh@0" === */
+/* Release version: 1.2.0 */
+"""
+
+contents = [
+    config,
+    config.rstrip('\n'),
+    config + vyos_foot,
+    config + vyatta_foot,
+    config + "\n" + vyos_foot + "\n",
+    config + vyos_foot.rstrip('\n'),
+    vyos_foot,
+    "",
+    config * 1000 + vyos_foot,
+]
+
+
+class TestFooter(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def write_file(self, name, content):
+        file_name = os.path.join(self.tmp_dir.name, name)
+        with open(file_name, 'w') as f:
+            f.write(content)
+        return file_name
+
+    def read_file(self, file_name):
+        with open(file_name) as f:
+            return f.read()
+
+    def test_read(self):
+        for content in contents:
+            with self.subTest(content=content[-200:]):
+                file_name = self.write_file('config.boot', content)
+                vyatta = formatversions.read_vyatta_versions(file_name)
+                vyos = formatversions.read_vyos_versions(file_name)
+                vintage, versions = formatversions.read_versions_footer(file_name)
+                self.assertEqual(versions, vyos or vyatta)
+                self.assertEqual(vintage, 'vyos' if vyos else 'vyatta' if vyatta else None)
+
+    def test_malformed(self):
+        file_name = self.write_file('config.boot', config + '// vyos-config-version: "ntp"\n')
+        with self.assertRaises(ValueError):
+            formatversions.read_versions_footer(file_name)
+
+    def test_write(self):
+        for content in contents:
+            for vintage in ['vyos', 'vyatta']:
+                with self.subTest(content=content[-200:], vintage=vintage):
+                    old_file = self.write_file('old', content)
+                    formatversions.remove_versions(old_file)
+                    if vintage == 'vyos':
+                        formatversions.write_vyos_versions_foot(old_file, 'ntp@1:ssh@1', '1.2.1')
+                    else:
+                        formatversions.write_vyatta_versions_foot(old_file, 'ntp@1:ssh@1', '1.2.1')
+
+                    new_file = self.write_file('new', content)
+                    formatversions.write_versions_footer(new_file, vintage, 'ntp@1:ssh@1', '1.2.1')
+
+                    self.assertEqual(self.read_file(new_file), self.read_file(old_file))
+
+    def test_small_tail(self):
+        # Footer and lines longer than the part that is read first
+        content = config + "x" * 100 + "\n" + vyos_foot
+        file_name = self.write_file('config.boot', content)
+        with mock.patch.object(formatversions, 'TAIL_SIZE', 16):
+            self.assertEqual(formatversions.read_versions_footer(file_name),
+                             ('vyos', {'ntp': 0, 'ssh': 0}))
+            formatversions.write_versions_footer(file_name, 'vyos', 'ntp@1', '1.2.1')
+        self.assertEqual(self.read_file(file_name),
+                         content[:-len(vyos_foot)] + formatversions.format_vyos_versions_foot('ntp@1', '1.2.1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
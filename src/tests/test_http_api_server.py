@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019 VyOS maintainers and contributors
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or later as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import io
+import os
+import json
+import time
+import threading
+import urllib.parse
+import unittest
+import importlib.util
+import importlib.machinery
+from unittest import TestCase, mock
+
+import bottle
+
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services', 'vyos-http-api-server')
+
+loader = importlib.machinery.SourceFileLoader('vyos_http_api_server', SERVER)
+spec = importlib.util.spec_from_loader(loader.name, loader)
+server = importlib.util.module_from_spec(spec)
+loader.exec_module(server)
+
+
+class FakeConfig(object):
+    """ Stand-in for vyos.config.Config with a config of many lines """
+    def __init__(self, lines=10000):
+        self.lines = lines
+
+    def exists(self, path):
+        return True
+
+    def iter_config(self, path='', format='raw', effective=False):
+        for i in range(self.lines):
+            yield "set firewall name FOO rule {0} action 'accept'\n".format(i)
+
+    def get_snapshot(self):
+        return self
+
+
+def request(route, **fields):
+    """ Makes bottle.request of this thread a POST request with the form fields """
+    body = urllib.parse.urlencode(fields).encode()
+    bottle.request.bind({
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': route,
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+    })
+
+
+class TestRetrieve(TestCase):
+    def setUp(self):
+        self.session = mock.Mock()
+        self.settings = server.load_settings({'api_keys': [{'id': 'test', 'key': 'secret'}]})
+        patcher = mock.patch.dict(server.app.config, {
+            'vyos_session': self.session,
+            'vyos_config': FakeConfig(),
+            'vyos_settings': self.settings,
+            'vyos_snapshot': None,
+            'vyos_snapshot_time': 0,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def retrieve(self, command):
+        request('/retrieve', key='secret', data=json.dumps(command))
+        return server.get_value()
+
+    def configure(self, commands):
+        request('/configure', key='secret', data=json.dumps(commands))
+        return server.configure()
+
+    def test_stream(self):
+        res = "".join(self.retrieve({'op': 'showConfig', 'path': [], 'configFormat': 'commands'}))
+        self.assertEqual(json.loads(res)['data'], "".join(FakeConfig().iter_config()))
+
+    def test_async_raw(self):
+        # Raw configs come from showConfig of the session even in async mode
+        self.settings['async_commit'] = True
+        server.app.config['vyos_snapshot'] = mock.Mock()
+        res = "".join(self.retrieve({'op': 'showConfig', 'path': []}))
+        self.assertEqual(json.loads(res)['data'], "".join(FakeConfig().iter_config()))
+        server.app.config['vyos_snapshot'].iter_config.assert_not_called()
+
+    def test_snapshot_reads(self):
+        self.settings['async_commit'] = True
+        snapshot = FakeConfig()
+        server.set_snapshot(snapshot)
+        with mock.patch('vyos.config.Config', return_value=FakeConfig()) as config:
+            # Reads do not wait for commits
+            with server.global_lock('test'):
+                res = self.retrieve({'op': 'exists', 'path': ['system']})
+            self.assertTrue(json.loads(res)['data'])
+            config.assert_not_called()
+
+            # Commits made outside the API are picked up when the snapshot gets old
+            with mock.patch('time.monotonic', return_value=time.monotonic() + 2):
+                self.retrieve({'op': 'exists', 'path': ['system']})
+            config.assert_called_once_with(session_env=self.session.get_session_env(), snapshot=True)
+            self.assertIs(server.app.config['vyos_snapshot'], config.return_value)
+
+    def test_paused_client(self):
+        chunks = self.retrieve({'op': 'showConfig', 'path': [], 'configFormat': 'commands'})
+        first = next(chunks)
+
+        # The client stops reading, commits must still go through
+        results = []
+        command = {'op': 'set', 'path': ['system', 'host-name'], 'value': 'vyos'}
+        t = threading.Thread(target=lambda: results.append(self.configure(command)), daemon=True)
+        t.start()
+        t.join(5)
+        self.assertFalse(t.is_alive())
+        self.assertTrue(json.loads(results[0])['success'])
+        self.session.commit.assert_called_once_with()
+
+        res = first + "".join(chunks)
+        self.assertEqual(json.loads(res)['data'], "".join(FakeConfig().iter_config()))
+
+
+if __name__ == '__main__':
+    unittest.main()
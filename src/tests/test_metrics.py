@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019 VyOS maintainers and contributors
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or later as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+import unittest
+from unittest import TestCase, mock
+
+from vyos.metrics import Registry
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        errors = self.registry.counter('errors_total', 'Errors', ['type'])
+        errors.inc(type='internal')
+        errors.inc(2, type='bad_request')
+        self.assertEqual(self.registry.render(),
+            '# HELP errors_total Errors\n'
+            '# TYPE errors_total counter\n'
+            'errors_total{type="bad_request"} 2\n'
+            'errors_total{type="internal"} 1\n')
+
+    def test_histogram(self):
+        latency = self.registry.histogram('latency_seconds', 'Latency', buckets=[0.1, 1])
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+        self.assertEqual(self.registry.render(),
+            '# HELP latency_seconds Latency\n'
+            '# TYPE latency_seconds histogram\n'
+            'latency_seconds_bucket{le="0.1"} 1\n'
+            'latency_seconds_bucket{le="1"} 2\n'
+            'latency_seconds_bucket{le="+Inf"} 3\n'
+            'latency_seconds_sum 5.55\n'
+            'latency_seconds_count 3\n')
+
+    def test_time(self):
+        latency = self.registry.histogram('latency_seconds', 'Latency', ['op'])
+        with mock.patch('time.monotonic', side_effect=[1.0, 1.5]):
+            with latency.time(op='set'):
+                pass
+        self.assertIn('latency_seconds_sum{op="set"} 0.5\n', self.registry.render())
+
+    def test_label_escaping(self):
+        errors = self.registry.counter('errors_total', 'Errors', ['type'])
+        errors.inc(type='a "b"\n')
+        self.assertIn('errors_total{type="a \\"b\\"\\n"} 1\n', self.registry.render())
+
+    def test_wrong_labels(self):
+        errors = self.registry.counter('errors_total', 'Errors', ['type'])
+        with self.assertRaises(ValueError):
+            errors.inc(code=500)
+
+
+if __name__ == '__main__':
+    unittest.main()
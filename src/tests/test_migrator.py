@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019 VyOS maintainers and contributors
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or later as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+import os
+import tempfile
+import unittest
+from unittest import TestCase, mock
+
+import vyos.defaults
+import vyos.configtree
+from vyos.migrator import Migrator, VirtualMigrator, MigratorError, is_inprocess_script, get_declared_paths, group_chains
+
+
+inprocess_script = """#!/usr/bin/env python3
+
+def migrate(config):
+    config.set(['{0}'])
+
+if __name__ == '__main__':
+    raise Exception("Must not run as a script")
+"""
+
+declared_script = """#!/usr/bin/env python3
+
+config_paths = [['{0}']]
+
+def migrate(config):
+    config.set(['{0}'])
+"""
+
+legacy_script = """#!/bin/sh
+echo "{0}" >> "$1"
+"""
+
+
+class TestMigrator(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+        self.config_file = os.path.join(self.tmp_dir.name, 'config.boot')
+        with open(self.config_file, 'w') as f:
+            f.write("initial\n")
+
+        patcher = mock.patch.dict(vyos.defaults.directories, {'migrate': self.tmp_dir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # A stand-in for the config tree that records the nodes set by the scripts
+        def from_file(file_name):
+            with open(file_name) as f:
+                content = f.read()
+            tree = mock.Mock()
+            nodes = []
+            tree.set.side_effect = lambda path: nodes.append(path[0])
+            tree.to_string.side_effect = lambda: content + "".join(n + "\n" for n in nodes)
+            return tree
+
+        patcher = mock.patch.object(vyos.configtree.ConfigTree, 'from_file', side_effect=from_file)
+        self.from_file = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_script(self, component, version, template):
+        os.makedirs(os.path.join(self.tmp_dir.name, component), exist_ok=True)
+        script = os.path.join(self.tmp_dir.name, component, '{0}-to-{1}'.format(version, version + 1))
+        with open(script, 'w') as f:
+            f.write(template.format('{0}-{1}'.format(component, version)))
+        os.chmod(script, 0o755)
+        return script
+
+    def test_detect(self):
+        self.assertTrue(is_inprocess_script(self.add_script('ntp', 0, inprocess_script)))
+        self.assertFalse(is_inprocess_script(self.add_script('ssh', 0, legacy_script)))
+
+    def test_inprocess(self):
+        self.add_script('ntp', 0, inprocess_script)
+        self.add_script('ntp', 1, inprocess_script)
+        self.add_script('ssh', 0, inprocess_script)
+
+        migrator = Migrator(self.config_file)
+        versions = migrator.run_migration_scripts({}, {'ntp': 2, 'ssh': 1})
+
+        self.assertEqual(versions, {'ntp': 2, 'ssh': 1})
+        self.assertEqual(self.from_file.call_count, 1)
+        with open(self.config_file) as f:
+            self.assertEqual(f.read(), "initial\nntp-0\nntp-1\nssh-0\n")
+
+    def test_legacy_in_between(self):
+        self.add_script('ntp', 0, inprocess_script)
+        self.add_script('snmp', 0, legacy_script)
+        self.add_script('ssh', 0, inprocess_script)
+
+        migrator = Migrator(self.config_file)
+        migrator.run_migration_scripts({}, {'ntp': 1, 'snmp': 1, 'ssh': 1})
+
+        # The file is parsed again after the legacy script has changed it
+        self.assertEqual(self.from_file.call_count, 2)
+        with open(self.config_file) as f:
+            self.assertEqual(f.read(), "initial\nntp-0\nsnmp-0\nssh-0\n")
+
+    def test_declared_paths(self):
+        self.assertEqual(get_declared_paths(self.add_script('ntp', 0, declared_script)), [['ntp-0']])
+        self.assertIsNone(get_declared_paths(self.add_script('ssh', 0, inprocess_script)))
+
+    def test_declared_serial(self):
+        self.add_script('ntp', 0, declared_script)
+        self.add_script('snmp', 0, legacy_script)
+        self.add_script('ssh', 0, declared_script)
+
+        migrator = Migrator(self.config_file)
+        with mock.patch('os.cpu_count', return_value=1):
+            versions = migrator.run_migration_scripts({}, {'ntp': 1, 'snmp': 1, 'ssh': 1})
+
+        self.assertEqual(versions, {'ntp': 1, 'snmp': 1, 'ssh': 1})
+        with open(self.config_file) as f:
+            self.assertEqual(f.read(), "initial\nntp-0\nsnmp-0\nssh-0\n")
+
+    def test_declared_fast(self):
+        self.add_script('ntp', 0, declared_script)
+        self.add_script('ssh', 0, declared_script)
+
+        # Scripts that are not known to be slow are not worth worker processes
+        migrator = Migrator(self.config_file)
+        with mock.patch('os.cpu_count', return_value=4), \
+             mock.patch('concurrent.futures.ProcessPoolExecutor') as executor:
+            migrator.run_migration_scripts({}, {'ntp': 1, 'ssh': 1})
+        executor.assert_not_called()
+        with open(self.config_file) as f:
+            self.assertEqual(f.read(), "initial\nntp-0\nssh-0\n")
+
+    def test_parallel_saving(self):
+        chains = [('ntp', [self.add_script('ntp', 0, declared_script)], [['ntp-0']]),
+                  ('ssh', [self.add_script('ssh', 0, declared_script)], [['ssh-0']]),
+                  ('snmp', [self.add_script('snmp', 0, declared_script)], [['snmp-0']])]
+        migrator = Migrator(self.config_file)
+        migrator._timings = {'ntp/0-to-1': 3.0, 'ssh/0-to-1': 2.0}
+        self.assertEqual(migrator.get_parallel_saving(group_chains(chains)), 2.0)
+
+    def run_cached(self, cache_dir):
+        with open(self.config_file, 'w') as f:
+            f.write("initial\n")
+        migrator = Migrator(self.config_file, cache_dir=cache_dir)
+        with mock.patch('vyos.systemversions.get_system_versions', return_value={'ntp': 2}), \
+             mock.patch('vyos.version.get_version', return_value='1.2.1'):
+            migrator.run()
+        with open(self.config_file) as f:
+            return migrator, f.read()
+
+    def test_cache(self):
+        self.add_script('ntp', 0, inprocess_script)
+        self.add_script('ntp', 1, legacy_script)
+        cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+
+        migrator, first = self.run_cached(cache_dir)
+        self.assertEqual(self.from_file.call_count, 1)
+        self.assertTrue(migrator.config_changed())
+
+        migrator, second = self.run_cached(cache_dir)
+        self.assertEqual(self.from_file.call_count, 1)
+        self.assertTrue(migrator.config_changed())
+        self.assertEqual(first, second)
+        self.assertIn('ntp-1\n', second)
+
+    def test_plan(self):
+        self.add_script('ntp', 0, inprocess_script)
+        self.add_script('ntp', 1, legacy_script)
+        cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+
+        migrator = Migrator(self.config_file, cache_dir=cache_dir)
+        with mock.patch('vyos.systemversions.get_system_versions', return_value={'ntp': 2}), \
+             mock.patch('vyos.version.get_version', return_value='1.2.1'):
+            scripts, cached = migrator.plan()
+        self.assertEqual(scripts, [('ntp/0-to-1', True, None), ('ntp/1-to-2', False, None)])
+        self.assertFalse(cached)
+
+        self.run_cached(cache_dir)
+        with open(self.config_file, 'w') as f:
+            f.write("initial\n")
+
+        migrator = Migrator(self.config_file, cache_dir=cache_dir)
+        with mock.patch('vyos.systemversions.get_system_versions', return_value={'ntp': 2}), \
+             mock.patch('vyos.version.get_version', return_value='1.2.1'):
+            scripts, cached = migrator.plan()
+        self.assertEqual([s[0] for s in scripts], ['ntp/0-to-1', 'ntp/1-to-2'])
+        self.assertTrue(all(s[2] is not None for s in scripts))
+        self.assertTrue(cached)
+
+    def test_virtual_plan(self):
+        self.add_script('ntp', 0, inprocess_script)
+        with self.assertRaises(MigratorError):
+            VirtualMigrator(self.config_file).plan()
+
+        with open(self.config_file, 'w') as f:
+            f.write('initial\n/* Warning: Do not remove the following line. */\n'
+                    '/* === vyatta-config-version: "ntp@0:ssh@0" === */\n')
+        self.assertEqual(VirtualMigrator(self.config_file).plan(), ([], False))
+
+
+class TestGroupChains(TestCase):
+    def test_independent(self):
+        chains = [('ntp', [], [['system', 'ntp']]),
+                  ('ssh', [], [['service', 'ssh']])]
+        self.assertEqual(group_chains(chains), [[chains[0]], [chains[1]]])
+
+    def test_overlap(self):
+        chains = [('a', [], [['system', 'ntp']]),
+                  ('b', [], [['service', 'ssh']]),
+                  ('c', [], [['interfaces']]),
+                  ('d', [], [['system'], ['interfaces', 'ethernet']])]
+        self.assertEqual(group_chains(chains),
+            [[chains[0], chains[2], chains[3]], [chains[1]]])
+
+    def test_siblings(self):
+        chains = [('a', [], [['system', 'ntp']]),
+                  ('b', [], [['system', 'ntpd']])]
+        self.assertEqual(len(group_chains(chains)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019 VyOS maintainers and contributors
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or later as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+import unittest
+from unittest import TestCase
+
+import vyos.validators as validators
+
+
+class TestValidators(TestCase):
+    def check(self, validator, valid, invalid):
+        for value in valid:
+            with self.subTest(value=value):
+                self.assertTrue(validator(value))
+        for value in invalid:
+            with self.subTest(value=value):
+                self.assertFalse(validator(value))
+
+    def test_ipv4(self):
+        self.check(validators.is_ipv4_single, ['192.0.2.1', '0.0.0.0'],
+                   ['192.0.2.1/24', '192.0.2', '192.0.2.256', '2001:db8::1', 'foo', ''])
+        self.check(validators.is_ipv4_host, ['192.0.2.1/24', '192.0.2.0/31', '192.0.2.0/32'],
+                   ['192.0.2.0/24', '192.0.2.1', '192.0.2.1/33', '192.0.2.1/255.255.255.0'])
+        self.check(validators.is_ipv4_net, ['192.0.2.0/24', '0.0.0.0/0'],
+                   ['192.0.2.1/24', '192.0.2.0'])
+
+    def test_ipv6(self):
+        self.check(validators.is_ipv6_single, ['2001:db8::1', '::'],
+                   ['2001:db8::1/64', 'fe80::1%eth0', '192.0.2.1', '2001:db8:::1'])
+        self.check(validators.is_ipv6_host, ['2001:db8::1/64', '2001:db8::/128'],
+                   ['2001:db8::/64', '2001:db8::1'])
+        self.check(validators.is_ipv6_net, ['2001:db8::/64', '::/0'],
+                   ['2001:db8::1/64'])
+
+    def test_any(self):
+        self.check(validators.is_any_cidr, ['192.0.2.0/24', '192.0.2.1/24', '2001:db8::1/64'],
+                   ['192.0.2.1', '2001:db8::1'])
+        self.check(validators.is_any_net, ['192.0.2.0/24', '2001:db8::/64'],
+                   ['192.0.2.1/24', '2001:db8::1/64'])
+
+    def test_mac_address(self):
+        self.check(validators.is_mac_address, ['00:53:00:ab:CD:ef'],
+                   ['00:53:00:ab:cd', '00-53-00-ab-cd-ef', '00:53:00:ab:cd:eg'])
+
+    def test_numeric(self):
+        self.check(validators.numeric(['--range', '1-65535']), ['1', '22', '65535'],
+                   ['0', '65536', '1.5', 'foo'])
+        self.check(validators.numeric(['--positive']), ['1'], ['0', '-1'])
+        self.check(validators.numeric(['--non-negative']), ['0'], ['-1'])
+        self.check(validators.numeric(['--float']), ['1.5', '-2'], ['foo'])
+        self.assertIsNone(validators.numeric(['--range', 'foo']))
+        self.assertIsNone(validators.numeric(['--unknown']))
+
+    def test_get_validator(self):
+        validators_dir = '/usr/libexec/vyos/validators'
+        self.assertIs(validators.get_validator('/usr/libexec/vyos/validators/ipv4-address', validators_dir),
+                      validators.is_ipv4_single)
+        self.assertTrue(validators.get_validator('/usr/libexec/vyos/validators/numeric --range 1-10 ', validators_dir)('5'))
+        self.assertIsNone(validators.get_validator('/usr/libexec/vyos/validators/script', validators_dir))
+        self.assertIsNone(validators.get_validator('/tmp/ipv4-address', validators_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()